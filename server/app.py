@@ -1,27 +1,48 @@
-import glob
-import RPi.GPIO as GPIO
+import os
 import re
+import gzip
+import fcntl
 import traceback
 import json
-import time
-import datetime
 import atexit
-import threading
-import netifaces
-import asyncio
 
-from rpi_hardware_pwm import HardwarePWM
-from math import floor
-from flask import Flask, request
+from math import floor, inf, isfinite, isinf
+from time import perf_counter
+from flask import Flask, Response, g, has_request_context, request
 from flask_cors import CORS
 from pid import PID
-from autotune import PIDAutotune
-from apscheduler.schedulers.background import BackgroundScheduler
+from autotune import PIDAutotune, StepAutotune
+from sensor import TemperatureSampler, SysfsFile, RESOLUTION_STEPS, DEFAULT_RESOLUTION
+from estimator import KalmanEstimator, SmithPredictor
+from cache import TtlCache
+from clock import Clock, ScaledClock
+from scheduler import ControlScheduler
+from hardware import RaspberryPiHardware, SimulatedHardware
+from simulator import Kettle
+from buzzer import Buzzer
+from zone import Zone
+from status import build_status, finish_status
+from broadcast import Broadcaster
+from snapshot import Snapshot
+from metrics import Registry, TimedLock
+from storage import AtomicWriter
+from eventlog import EventLog
+from settings import SettingsStore, validate_settings
+from session import SessionWriter, list_sessions, read_session, EXTENSION as SESSION_EXTENSION
 from logging.config import dictConfig
-from datetime import datetime, timezone
+
+try:
+    import netifaces
+except ImportError:
+    netifaces = None
 
 OK_RESPONSE = "{\"status\": \"OK\"}", 200, {'Content-Type': 'application/json'}
 BAD_REQUEST_RESPONSE = "{\"status\": \"BAD_REQUEST\"}", 400, {'Content-Type': 'application/json'}
+NOT_FOUND_RESPONSE = "{\"status\": \"NOT_FOUND\"}", 404, {'Content-Type': 'application/json'}
+# smaller bodies barely shrink, compressing them costs more than sending them
+GZIP_MIN_SIZE = 1024
+GZIP_LEVEL = 6
+COMPRESSIBLE_MIMETYPES = {"application/json", "text/plain", "text/html"}
 
 dictConfig({
     'version': 1,
@@ -39,15 +60,32 @@ dictConfig({
     }
 })
 
-GPIO.setmode(GPIO.BOARD)
-
-pump_pin = 13
-fan_tach_pin = 37
-buzzer_pin = 18
-
-GPIO.setup(pump_pin, GPIO.OUT)
-GPIO.setup(buzzer_pin, GPIO.OUT)
-GPIO.setup(fan_tach_pin, GPIO.IN, pull_up_down=GPIO.PUD_OFF)
+# the controller owns the sensors and GPIO pins, a second process (another gunicorn worker) must not run it too
+controller_lock_file = open("controller.lock", "w")
+try:
+    fcntl.flock(controller_lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+except BlockingIOError:
+    raise RuntimeError("The controller is already running in another process, run a single worker") from None
+
+settings_store = SettingsStore("config.json")
+stored_settings = settings_store.load()
+
+def read_zone_configs():
+    zone_configs = None if stored_settings is None else stored_settings.get("zones")
+    # without a zone configuration there is a single kettle on the hardware PWM heater
+    return zone_configs or [{"name": "kettle"}]
+
+zone_configs = read_zone_configs()
+# the implicit kettle isn't written to the settings unless it has settings of its own
+zones_configured = stored_settings is not None and bool(stored_settings.get("zones"))
+
+# BREW_HARDWARE=simulated runs the controller against simulated kettles, BREW_SIMULATION_SPEED makes time pass faster
+if os.environ.get("BREW_HARDWARE", "raspberry-pi") == "simulated":
+    clock = ScaledClock(float(os.environ.get("BREW_SIMULATION_SPEED", "1")))
+    hardware = SimulatedHardware({config.get("sensor", f"28-simulated-{config['name']}"): Kettle() for config in zone_configs}, clock)
+else:
+    clock = Clock()
+    hardware = RaspberryPiHardware()
 
 tach_counter = 0
 
@@ -55,62 +93,87 @@ def increment_tach_counter():
     global tach_counter
     tach_counter += 1
 
-#GPIO.add_event_detect(fan_tach_pin, GPIO.RISING, callback=increment_tach_counter)
-
-fan_pwm = HardwarePWM(pwm_channel=0, hz=20000, chip=0)
-fan_pwm.start(100)
-
-heater_pwm = HardwarePWM(pwm_channel=1, hz=50, chip=0)
-heater_pwm.start(0)
+#hardware.set_tach_callback(increment_tach_counter)
 
-mode = "off"
 pump = False
 
-has_temperature_sensor_error = True
 previous_time = 0.0
-temperature = 0.0
-previous_temperature = temperature
 initial_setpoint = 65.0
 fan_power = 100
-setpoint = initial_setpoint
 boil_threshold = 99.7
 boil_power = 50.0
-previous_duty_cycle = 0.0
-duty_cycle = 0.0
 last_fan_check = 0
 fan_rpm = 0
 
-timestamps = []
-temperature_history = []
-setpoint_history = []
-duty_cycle_history = []
+zones = []
+zones_by_name = {}
+snapshots = {}
 
-k_p = 1.0
-k_i = 1.0
-k_d = 1.0
-
-alarm_armed = False
-boil_achieved = False
-
-pid = None
-tuner = None
 selected_tuning_mode = None
-peak_count = 0
-messages = []
-logs = []
+# clients read both from the sequence of the last event they have, reading never removes anything
+messages = EventLog(20)
+logs = EventLog(50)
 
 sample_time = 1.0
+# coarse readings convert faster and are read more often, but not more often than this
+min_sample_time = 0.25
+control_period = sample_time
+control_dt = control_period
+record_elapsed = 0.0
+is_record_due = True
+sessions_dir = "sessions"
+# the oldest sessions are deleted when a new one starts beyond either limit, a session takes 230 kB per hour
+max_sessions = 200
+max_session_bytes = 200 * 1024 * 1024
+# coarse readings convert in 94 ms instead of 750 ms, they only serve a PID whose output is at a limit, where a 0.5 °C
+# step can't move it
+FINE_RESOLUTION = 12
+COARSE_RESOLUTION = 9
+# how long the PID output has to stay at a limit before the readings get coarse, so a single saturated tick near the
+# setpoint doesn't switch back and forth
+coarse_resolution_delay = 10.0
+checkpoint_interval = 10.0
+# an older checkpoint is from a previous brew rather than a restart, the controller starts off then
+checkpoint_max_age = 300.0
+checkpoint_elapsed = 0.0
+# what the checkpoint file holds, the file on disk is unknown until it's written once
+last_checkpoint_zones = None
+last_checkpoint_timestamp = 0
+last_checkpoint_resumable = True
+RESUMABLE_MODES = ["auto", "manual", "boil"]
+# sessions of the first zone are named by the start time, other zones append their name
+SESSION_NAME_PATTERN = re.compile(r"\d+(-\w+)?")
 
 app = Flask("brew")
 base_url = "/api"
-CORS(app)
-
-lock = threading.Lock()
+# browsers cache the preflight of the UI's PUT requests instead of repeating it before each one
+CORS(app, max_age=600)
+
+metrics = Registry()
+lock = TimedLock(metrics, "control", lambda: "http" if has_request_context() else "control")
+request_seconds = {}
+tick_seconds = metrics.summary("brew_tick_seconds", "Duration of a control loop tick")
+tick_lateness_seconds = metrics.summary("brew_tick_lateness_seconds", "How late control loop ticks started after their deadline")
+tick_overruns = metrics.counter("brew_tick_overruns_total", "Control loop ticks which took longer than the control period")
+missed_ticks = metrics.counter("brew_missed_ticks_total", "Control loop ticks dropped after an overrun")
+
+temperature_sampler = TemperatureSampler(lambda: hardware.read_temperatures(zone_sensors), interval=sample_time, min_interval=min_sample_time, max_age=3 * sample_time,
+                                         set_resolution=hardware.set_resolution, clock=clock)
+broadcaster = Broadcaster()
+# the info snapshot is rebuilt every tick, values which change slowly are only read now and then
+cpu_temperature_file = SysfsFile('/sys/class/thermal/thermal_zone0/temp')
+cpu_temperature_cache = TtlCache(lambda: get_cpu_temperature(), 5.0)
+ip_cache = TtlCache(lambda: get_ip(), 60.0)
+buzzer = Buzzer(hardware.set_buzzer)
+checkpoint_writer = AtomicWriter("state.json")
 
 def add_log(message):
-    logs.append(dict(millis=get_current_timestamp(), text=message))
-    if len(logs) > 50:
-        logs.pop(0)
+    log = logs.append(dict(millis=get_current_timestamp(), text=message))
+    broadcaster.publish("log", log)
+
+def add_message(message):
+    message = messages.append(dict(message))
+    broadcaster.publish("message", message)
 
 def log_info(message):
     app.logger.info(message)
@@ -120,32 +183,70 @@ def log_error(message):
     app.logger.error(message)
     add_log(message)
 
-def load_settings():
+def create_zones():
+    sensors = hardware.discover_sensors()
+    configured = {config["sensor"] for config in zone_configs if "sensor" in config}
+    unassigned = [sensor for sensor in sensors if sensor not in configured]
+    assigned_heaters = {}
+    assigned_sensors = {}
+    for config in zone_configs:
+        # zones without a configured sensor get the remaining sensors in discovery order
+        if "sensor" in config:
+            sensor = config["sensor"]
+        else:
+            sensor = unassigned.pop(0) if unassigned else None
+        if sensor is None or sensor not in sensors:
+            log_error(f"No temperature sensor found for zone {config['name']}")
+        # a shared heater would be driven by two PIDs at once, the configuration is refused rather than shared
+        heater_pin = config.get("heater_pin")
+        if heater_pin in assigned_heaters:
+            heater_name = "hardware PWM heater" if heater_pin is None else f"heater on pin {heater_pin}"
+            raise RuntimeError(f"Zones {assigned_heaters[heater_pin]} and {config['name']} both use the {heater_name}")
+        if sensor is not None and sensor in assigned_sensors:
+            raise RuntimeError(f"Zones {assigned_sensors[sensor]} and {config['name']} both use sensor {sensor}")
+        assigned_heaters[heater_pin] = config["name"]
+        if sensor is not None:
+            assigned_sensors[sensor] = config["name"]
+        zone = Zone(config["name"], sensor, hardware.heater(heater_pin, sensor), heater_pin)
+        zone.sensor_configured = "sensor" in config
+        zones.append(zone)
+        zones_by_name[zone.name] = zone
+    log_info(f"Zones: {', '.join(f'{zone.name} ({zone.sensor})' for zone in zones)}")
+
+def load_settings(settings):
     global initial_setpoint
     global fan_power
-    global setpoint
     global boil_threshold
     global boil_power
-    global k_p
-    global k_i
-    global k_d
-    try:
-        with open('config.json', 'r') as file:
-            settings = json.load(file)    
-            initial_setpoint = settings["initial_setpoint"]
-            fan_power = settings["fan_power"]
-            setpoint = initial_setpoint
-            boil_threshold = settings["boil_threshold"]
-            boil_power = settings["boil_power"]
-            k_p = settings["k_p"]
-            k_i = settings["k_i"]
-            k_d = settings["k_d"]
-        log_info("Initialized settings from config.json!")
-    except Exception:
-        log_error("Failed initializing setting from config.json, using defaults!")
-        log_error(traceback.format_exc())
-        pass
+    global control_period
+    if settings is None:
+        log_error(f"No valid settings in {settings_store.path}, using defaults!")
+    else:
+        initial_setpoint = settings["initial_setpoint"]
+        fan_power = settings["fan_power"]
+        boil_threshold = settings["boil_threshold"]
+        boil_power = settings["boil_power"]
+        # the top level gains are used by zones which don't have their own
+        zone_settings = {config["name"]: config for config in settings.get("zones", [])}
+        for zone in zones:
+            zone_setting = zone_settings.get(zone.name, {})
+            zone.k_p = zone_setting.get("k_p", settings["k_p"])
+            zone.k_i = zone_setting.get("k_i", settings["k_i"])
+            zone.k_d = zone_setting.get("k_d", settings["k_d"])
+            zone.estimator_enabled = zone_setting.get("estimator", False)
+            zone.estimator_lead_time = zone_setting.get("estimator_lead_time", 0.0)
+            zone.smith_predictor_enabled = zone_setting.get("smith_predictor", False)
+            model = zone_setting.get("model")
+            if model is not None:
+                time_constant = inf if model["time_constant"] is None else model["time_constant"]
+                zone.model = StepAutotune.Model(model["slope"], time_constant, model["dead_time"])
+        control_period = settings.get("control_period", control_period)
+        log_info(f"Initialized settings from {settings_store.path}!")
+    for zone in zones:
+        zone.setpoint = initial_setpoint
+        configure_estimator(zone)
     set_fan_power()
+    publish_settings_snapshots()
 
 def save_settings():
     settings = {}
@@ -153,104 +254,124 @@ def save_settings():
     settings["fan_power"] = fan_power
     settings["boil_threshold"] = boil_threshold
     settings["boil_power"] = boil_power
-    settings["k_p"] = k_p
-    settings["k_i"] = k_i
-    settings["k_d"] = k_d
-    with open('config.json', 'w+') as file:
-        file.write(json.dumps(settings))
-    log_info("Wrote to config.json!")
-
-def initialize_pid():
-    global pid
-    pid = PID(sample_time, k_p, k_i, k_d)
-
-def reset_pid():
-    global pid
-    if pid is None:
-        return
-    log_info("Resetting PID")
-    initialize_pid()
+    settings["k_p"] = zones[0].k_p
+    settings["k_i"] = zones[0].k_i
+    settings["k_d"] = zones[0].k_d
+    settings["control_period"] = control_period
+    if zones_configured or any(has_zone_settings(zone) for zone in zones):
+        settings["zones"] = [zone_settings(zone) for zone in zones]
+    # the store writes in the background, a slow SD card doesn't hold the lock
+    try:
+        settings_store.save(settings)
+    except ValueError as error:
+        log_error(f"Not saving invalid settings: {error}")
+    publish_settings_snapshots()
+
+def zone_settings(zone):
+    settings = dict(name=zone.name, k_p=zone.k_p, k_i=zone.k_i, k_d=zone.k_d, estimator=zone.estimator_enabled,
+                    estimator_lead_time=zone.estimator_lead_time, smith_predictor=zone.smith_predictor_enabled)
+    if zone.model is not None:
+        # JSON has no infinity, an integrating process has no time constant
+        time_constant = None if isinf(zone.model.time_constant) else zone.model.time_constant
+        settings["model"] = dict(slope=zone.model.slope, time_constant=time_constant, dead_time=zone.model.dead_time)
+    # a discovered sensor isn't pinned, a replaced probe is discovered again
+    if zone.sensor_configured:
+        settings["sensor"] = zone.sensor
+    if zone.heater_pin is not None:
+        settings["heater_pin"] = zone.heater_pin
+    return settings
+
+def has_zone_settings(zone):
+    # the gains of the first zone are the top level gains
+    return (zone.estimator_enabled or zone.estimator_lead_time != 0.0 or zone.smith_predictor_enabled
+            or zone.model is not None)
+
+def zone_text(zone, text):
+    return text if len(zones) == 1 else f"{zone.name}: {text}"
+
+def configure_estimator(zone):
+    zone.estimator = KalmanEstimator(lead_time=zone.estimator_lead_time) if zone.estimator_enabled else None
+    zone.predictor = None
+    if zone.smith_predictor_enabled:
+        if zone.model is None or zone.model.slope <= 0:
+            log_error(zone_text(zone, "The Smith predictor needs a model from the step autotune, it stays off!"))
+        else:
+            zone.predictor = SmithPredictor(*zone.model)
+    zone.estimator_timestamp = None
+    zone.estimated_temperature = None
+    zone.estimated_rate = None
+
+def initialize_pid(zone):
+    zone.pid = PID(sample_time, zone.k_p, zone.k_i, zone.k_d, time=clock.time)
 
 def get_current_timestamp():
-    return floor((datetime.now(timezone.utc) - datetime(1970, 1, 1, tzinfo=timezone.utc)).total_seconds() * 1000)
+    return floor(clock.time() * 1000)
 
 def set_pump_status(status):
     global pump
     pump = status
-    if status: 
-        log_info("Pump turned ON")
-        GPIO.output(pump_pin, GPIO.HIGH)
-    else:
-        log_info("Pump turned OFF")
-        GPIO.output(pump_pin, GPIO.LOW)
+    log_info("Pump turned ON" if status else "Pump turned OFF")
+    hardware.set_pump(status)
 
-def set_pid_status(status):
-    global pid
+def set_pid_status(zone, status):
     if status:
-        initialize_pid()
-        log_info("PID turned ON")
+        initialize_pid(zone)
+        log_info(zone_text(zone, "PID turned ON"))
     else:
-        pid = None
-        log_info("PID turned OFF")
+        zone.pid = None
+        log_info(zone_text(zone, "PID turned OFF"))
 
-async def buzzer_off():
-    await asyncio.sleep(0.5)
-    GPIO.output(buzzer_pin, GPIO.LOW)
-
-def buzz():
+def buzz(pattern=Buzzer.BEEP):
     log_info("BUZZ")
-    GPIO.output(buzzer_pin, GPIO.HIGH)
-    asyncio.run(buzzer_off())
+    buzzer.play(pattern)
 
-def handle_boil():
-    global duty_cycle
-    global boil_achieved
-    if mode != "boil":
+def handle_boil(zone):
+    if zone.mode != "boil":
         return
-    if not boil_achieved:
-        duty_cycle = 100
-        if temperature >= boil_threshold:
-            buzz()
-            boil_achieved = True
-    if boil_achieved:
-        duty_cycle = boil_power
-
-def set_mode(new_mode):
-    log_info(f"Mode set to: {new_mode}")
-    global mode
-    global duty_cycle
-    global alarm_armed
-    global boil_achieved
-    global tuner
-    mode = new_mode
-    if mode == "off":
-        set_pid_status(False)
-        duty_cycle = 0
-        alarm_armed = False
-        tuner = None
-    elif mode == "auto":
-        reset_pid()
-        set_pid_status(True)
-        alarm_armed = True
-        duty_cycle = 0
-        tuner = None
-    elif mode == "manual":
-        set_pid_status(False)
-        alarm_armed = False
-        tuner = None
-    elif mode == "boil":
-        set_pid_status(False)
-        alarm_armed = False
-        boil_achieved = False
-        handle_boil()
-        tuner = None
-    elif mode == "tuning":
-        alarm_armed = False
-        duty_cycle = 0
-        set_pid_status(False)
-        global peak_count
-        peak_count = 0
-        tuner = PIDAutotune(sample_time, initial_setpoint, 100)
+    if not zone.boil_achieved:
+        zone.duty_cycle = 100
+        if zone.temperature >= boil_threshold:
+            buzz(Buzzer.LONG_TONE)
+            zone.boil_achieved = True
+    if zone.boil_achieved:
+        zone.duty_cycle = boil_power
+
+def set_mode(zone, new_mode):
+    log_info(zone_text(zone, f"Mode set to: {new_mode}"))
+    zone.mode = new_mode
+    if zone.mode == "off":
+        set_pid_status(zone, False)
+        zone.duty_cycle = 0
+        zone.alarm_armed = False
+        zone.tuner = None
+    elif zone.mode == "auto":
+        # a running PID keeps its state through setpoint changes, a new one takes over the duty cycle of the
+        # previous mode without a bump
+        if zone.pid is None:
+            set_pid_status(zone, True)
+            zone.pid.initialize(zone.temperature if zone.control_temperature is None else zone.control_temperature, zone.duty_cycle)
+        zone.alarm_armed = True
+        zone.tuner = None
+    elif zone.mode == "manual":
+        set_pid_status(zone, False)
+        zone.alarm_armed = False
+        zone.tuner = None
+    elif zone.mode == "boil":
+        set_pid_status(zone, False)
+        zone.alarm_armed = False
+        zone.boil_achieved = False
+        handle_boil(zone)
+        zone.tuner = None
+    elif zone.mode == "tuning":
+        zone.alarm_armed = False
+        zone.duty_cycle = 0
+        set_pid_status(zone, False)
+        zone.peak_count = 0
+        # the model based rules tune from a single heat-up, the others from relay oscillations
+        if selected_tuning_mode in StepAutotune.TUNING_RULES:
+            zone.tuner = StepAutotune(sample_time, initial_setpoint, 100, time=clock.time)
+        else:
+            zone.tuner = PIDAutotune(sample_time, initial_setpoint, 100, time=clock.time)
 
 def calculate_fan_rpm():
     global last_fan_check
@@ -266,194 +387,538 @@ def calculate_fan_rpm():
     tach_counter = 0
     last_fan_check = current_timestamp
 
+def publish_status_snapshot(zone):
+    cursor = zone.chart_history.cursor
+    # clients following along ask for the samples since their last response, which is usually the last sample
+    # the resolution the sensor converted the latest reading at, unknown if the driver can't set it
+    resolution = temperature_sampler.reading(zone.sensor).resolution
+    zone.status_snapshot = (cursor, Snapshot(build_status(zone, pump, resolution), finish_status),
+                            Snapshot(build_status(zone, pump, resolution, cursor - 1), finish_status))
+
+def publish_info_snapshot():
+    response = {}
+    cpuTemperature = cpu_temperature_cache.get()
+    if not cpuTemperature is None:
+        response["cpuTemperature"] = cpuTemperature
+    ip = ip_cache.get()
+    if not ip is None:
+        response["ip"] = ip
+    response["startMillis"] = start_millis
+    response["fanRpm"] = fan_rpm
+    snapshots["info"] = Snapshot(response)
+
+def publish_settings_snapshots():
+    for zone in zones:
+        response = {}
+        response["p"] = zone.k_p
+        response["i"] = zone.k_i
+        response["d"] = zone.k_d
+        snapshots[f"settings/pid/{zone.name}"] = Snapshot(response)
+        response = {}
+        response["estimator"] = zone.estimator_enabled
+        response["leadTime"] = zone.estimator_lead_time
+        response["smithPredictor"] = zone.smith_predictor_enabled
+        if zone.model is None:
+            response["model"] = None
+        else:
+            time_constant = None if isinf(zone.model.time_constant) else zone.model.time_constant
+            response["model"] = dict(slope=zone.model.slope, timeConstant=time_constant, deadTime=zone.model.dead_time)
+        snapshots[f"settings/estimator/{zone.name}"] = Snapshot(response)
+    response = {}
+    response["boilThreshold"] = boil_threshold
+    response["boilPower"] = boil_power
+    snapshots["settings/boil"] = Snapshot(response)
+    response = {}
+    response["initialSetpoint"] = initial_setpoint
+    response["fanPower"] = fan_power
+    snapshots["settings/other"] = Snapshot(response)
+
+def accepts_gzip():
+    return request.accept_encodings["gzip"] > 0
+
+def snapshot_response(snapshot):
+    body, etag = snapshot.encode()
+    if len(body) >= GZIP_MIN_SIZE and accepts_gzip():
+        body, etag = snapshot.encode_gzip()
+        response = Response(body, mimetype="application/json")
+        response.headers["Content-Encoding"] = "gzip"
+    else:
+        response = Response(body, mimetype="application/json")
+    response.vary.add("Accept-Encoding")
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+def get_request_zone():
+    # the zone parameter is optional, requests without it control the first zone
+    name = request.args.get("zone")
+    return zones[0] if name is None else zones_by_name.get(name)
+
+@app.route(base_url+"/zones", methods = ["GET"])
+def get_zones():
+    response = [dict(name=zone.name, sensor=zone.sensor) for zone in zones]
+    return json.dumps(response), 200, {'Content-Type': 'application/json'}
+
 @app.route(base_url+"/status", methods = ["GET"])
 def get_status():
+    zone = get_request_zone()
+    if zone is None:
+        return NOT_FOUND_RESPONSE
+    since = request.args.get("since", type=int)
+    points = request.args.get("points", type=int)
+    # the charts of the PID terms and the estimated temperature are only built for clients asking for them
+    terms = request.args.get("terms", default="false").lower() == "true"
+    estimate = request.args.get("estimate", default="false").lower() == "true"
+    if points is None and not terms and not estimate:
+        cursor, full_snapshot, delta_snapshot = zone.status_snapshot
+        if since is None:
+            return snapshot_response(full_snapshot)
+        if since == cursor - 1:
+            return snapshot_response(delta_snapshot)
     with lock:
-        response = {}
-        response["mode"] = mode
-        response["pump"] = pump
-        response["temperature"] = None if has_temperature_sensor_error else temperature
-        response["setpoint"] = setpoint
-        response["dutyCycle"] = duty_cycle
-        response["chartX"] = timestamps
-        response["chartTemperatureY"] = temperature_history
-        response["chartSetpointY"] = setpoint_history
-        response["chartDutyCycleY"] = duty_cycle_history
-        response["boilAchieved"] = boil_achieved
-        if not tuner is None:
-            response["autotunePeakCount"] = tuner.peak_count
-        return json.dumps(response), 200, {'Content-Type': 'application/json'}
+        response = build_status(zone, pump, temperature_sampler.reading(zone.sensor).resolution, since, points, terms, estimate)
+    return json.dumps(finish_status(response)), 200, {'Content-Type': 'application/json'}
+
+@app.route(base_url+"/stream", methods = ["GET"])
+def get_stream():
+    return Response(broadcaster.stream(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.route(base_url+"/setpoint", methods = ["PUT"])
 def put_setpoint():
+    zone = get_request_zone()
+    if zone is None:
+        return NOT_FOUND_RESPONSE
     with lock:
-        if has_temperature_sensor_error:
+        if zone.has_temperature_sensor_error:
             return BAD_REQUEST_RESPONSE
-        global setpoint
-        global alarm_armed
-        set_mode("auto")
-        setpoint = float(request.args.get("setpoint"))
-        alarm_armed = True
+        set_mode(zone, "auto")
+        zone.setpoint = float(request.args.get("setpoint"))
+        zone.alarm_armed = True
+        publish_status_snapshot(zone)
     return OK_RESPONSE
 
 @app.route(base_url+"/duty-cycle", methods = ["PUT"])
 def put_duty_cycle():
+    zone = get_request_zone()
+    if zone is None:
+        return NOT_FOUND_RESPONSE
     with lock:
-        if has_temperature_sensor_error:
+        if zone.has_temperature_sensor_error:
             return BAD_REQUEST_RESPONSE
-        global duty_cycle
         new_duty_cycle = float(request.args.get("dutyCycle"))
-        set_mode("manual" if new_duty_cycle > 0 else "off")
-        duty_cycle = new_duty_cycle
+        set_mode(zone, "manual" if new_duty_cycle > 0 else "off")
+        zone.duty_cycle = new_duty_cycle
+        publish_status_snapshot(zone)
     return OK_RESPONSE
 
 @app.route(base_url+"/mode", methods = ["PUT"])
 def put_mode():
+    zone = get_request_zone()
+    if zone is None:
+        return NOT_FOUND_RESPONSE
     with lock:
-        if has_temperature_sensor_error:
+        if zone.has_temperature_sensor_error:
             return BAD_REQUEST_RESPONSE
         new_tuning_mode = request.args.get("tuningMode")
         if not new_tuning_mode is None:
             global selected_tuning_mode
             selected_tuning_mode = new_tuning_mode
             log_info(f"Selected tuning mode: {selected_tuning_mode}")
-        set_mode(request.args.get("mode"))
+        set_mode(zone, request.args.get("mode"))
+        publish_status_snapshot(zone)
     return OK_RESPONSE
     
 @app.route(base_url+"/pump", methods = ["PUT"])
 def put_pump():
     with lock:
         set_pump_status(request.args.get("pump").lower() == "true")
+        for zone in zones:
+            publish_status_snapshot(zone)
     return OK_RESPONSE
 
 @app.route(base_url+"/settings/pid", methods = ["GET"])
 def get_pid_settings():
-    with lock:
-        response = {}
-        response["p"] = k_p
-        response["i"] = k_i
-        response["d"] = k_d
-        return json.dumps(response), 200, {'Content-Type': 'application/json'}
+    zone = get_request_zone()
+    if zone is None:
+        return NOT_FOUND_RESPONSE
+    return snapshot_response(snapshots[f"settings/pid/{zone.name}"])
 
 @app.route(base_url+"/settings/pid", methods = ["PUT"])
 def put_pid_settings():
+    zone = get_request_zone()
+    if zone is None:
+        return NOT_FOUND_RESPONSE
+    try:
+        new_settings = dict(k_p=float(request.args.get("p")), k_i=float(request.args.get("i")), k_d=float(request.args.get("d")))
+        validate_settings(new_settings, partial=True)
+    except (TypeError, ValueError):
+        return BAD_REQUEST_RESPONSE
     with lock:
-        global k_p
-        global k_i
-        global k_d
-        k_p = float(request.args.get("p"))
-        k_i = float(request.args.get("i"))
-        k_d = float(request.args.get("d"))
+        zone.k_p = new_settings["k_p"]
+        zone.k_i = new_settings["k_i"]
+        zone.k_d = new_settings["k_d"]
+        save_settings()
+        if zone.pid is not None:
+            zone.pid.set_tunings(zone.k_p, zone.k_i, zone.k_d)
+    return OK_RESPONSE
+
+@app.route(base_url+"/settings/estimator", methods = ["GET"])
+def get_estimator_settings():
+    zone = get_request_zone()
+    if zone is None:
+        return NOT_FOUND_RESPONSE
+    return snapshot_response(snapshots[f"settings/estimator/{zone.name}"])
+
+@app.route(base_url+"/settings/estimator", methods = ["PUT"])
+def put_estimator_settings():
+    zone = get_request_zone()
+    if zone is None:
+        return NOT_FOUND_RESPONSE
+    try:
+        new_settings = dict(name=zone.name,
+                            estimator=request.args.get("estimator").lower() == "true",
+                            estimator_lead_time=request.args.get("leadTime", default=zone.estimator_lead_time, type=float),
+                            smith_predictor=request.args.get("smithPredictor").lower() == "true")
+        # a model can be entered by hand, from backtest.py for example, the step autotune identifies one too
+        if request.args.get("slope") is not None:
+            time_constant = float(request.args.get("timeConstant", default="inf"))
+            new_settings["model"] = dict(slope=float(request.args.get("slope")),
+                                         time_constant=None if isinf(time_constant) else time_constant,
+                                         dead_time=float(request.args.get("deadTime")))
+        validate_settings(dict(zones=[new_settings]), partial=True)
+    except (AttributeError, TypeError, ValueError):
+        return BAD_REQUEST_RESPONSE
+    with lock:
+        zone.estimator_enabled = new_settings["estimator"]
+        zone.estimator_lead_time = new_settings["estimator_lead_time"]
+        zone.smith_predictor_enabled = new_settings["smith_predictor"]
+        if "model" in new_settings:
+            model = new_settings["model"]
+            zone.model = StepAutotune.Model(model["slope"], inf if model["time_constant"] is None else model["time_constant"], model["dead_time"])
+        configure_estimator(zone)
         save_settings()
-        reset_pid()
     return OK_RESPONSE
 
 @app.route(base_url+"/settings/boil", methods = ["GET"])
 def get_temperature_settings():
-    with lock:
-        response = {}
-        response["boilThreshold"] = boil_threshold
-        response["boilPower"] = boil_power
-        return json.dumps(response), 200, {'Content-Type': 'application/json'}
+    return snapshot_response(snapshots["settings/boil"])
 
 @app.route(base_url+"/settings/boil", methods = ["PUT"])
 def put_temperature_settings():
+    try:
+        new_settings = dict(boil_threshold=float(request.args.get("boilThreshold")), boil_power=float(request.args.get("boilPower")))
+        validate_settings(new_settings, partial=True)
+    except (TypeError, ValueError):
+        return BAD_REQUEST_RESPONSE
     with lock:
         global boil_threshold
         global boil_power
-        boil_threshold = float(request.args.get("boilThreshold"))
-        boil_power = float(request.args.get("boilPower"))
+        boil_threshold = new_settings["boil_threshold"]
+        boil_power = new_settings["boil_power"]
         save_settings()
-        if mode == "boil":
-            set_mode("boil")
+        for zone in zones:
+            if zone.mode == "boil":
+                set_mode(zone, "boil")
     return OK_RESPONSE
 
 @app.route(base_url+"/settings/other", methods = ["GET"])
 def get_other_settings():
-    with lock:
-        response = {}
-        response["initialSetpoint"] = initial_setpoint
-        response["fanPower"] = fan_power
-        return json.dumps(response), 200, {'Content-Type': 'application/json'}
+    return snapshot_response(snapshots["settings/other"])
 
 @app.route(base_url+"/settings/other", methods = ["PUT"])
 def put_other_settings():
+    try:
+        new_settings = dict(initial_setpoint=float(request.args.get("initialSetpoint")), fan_power=float(request.args.get("fanPower")))
+        validate_settings(new_settings, partial=True)
+    except (TypeError, ValueError):
+        return BAD_REQUEST_RESPONSE
     with lock:
         global initial_setpoint
         global fan_power
-        initial_setpoint = float(request.args.get("initialSetpoint"))
-        fan_power = float(request.args.get("fanPower"))
+        initial_setpoint = new_settings["initial_setpoint"]
+        fan_power = new_settings["fan_power"]
         set_fan_power()
         save_settings()
     return OK_RESPONSE
         
+def event_log_response(event_log, after):
+    events, cursor, missed = event_log.since(after)
+    response = {}
+    response["events"] = events
+    response["cursor"] = cursor
+    response["missed"] = missed
+    return json.dumps(response), 200, {'Content-Type': 'application/json'}
+
 @app.route(base_url+"/messages", methods = ["GET"])
 def get_messages():
-    with lock:
-        global messages        
-        response = []
-        response += messages
-        messages = []
-        return response, 200, {'Content-Type': 'application/json'}
+    # a client without a cursor starts at the latest message, older ones would pop up as stale toasts
+    return event_log_response(messages, request.args.get("after", default=messages.sequence, type=int))
+
+@app.route(base_url+"/logs", methods = ["GET"])
+def get_logs():
+    return event_log_response(logs, request.args.get("after", default=0, type=int))
         
 @app.route(base_url+"/info", methods = ["GET"])
 def get_info():
+    return snapshot_response(snapshots["info"])
+
+@app.route(base_url+"/sessions", methods = ["GET"])
+def get_sessions():
+    return json.dumps(list_sessions(sessions_dir)), 200, {'Content-Type': 'application/json'}
+
+@app.route(base_url+"/sessions", methods = ["PUT"])
+def put_sessions():
+    zone = get_request_zone()
+    if zone is None:
+        return NOT_FOUND_RESPONSE
+    record = request.args.get("record")
+    if record is None:
+        return BAD_REQUEST_RESPONSE
     with lock:
-        global messages        
-        response = {}
-        response["logs"] = logs
-        cpuTemperature = get_cpu_temperature()
-        if not cpuTemperature is None:
-            response["cpuTemperature"] = cpuTemperature
-        ip = get_ip()
-        if not ip is None:
-            response["ip"] = ip
-        response["startMillis"] = start_millis
-        response["fanRpm"] = fan_rpm
-        return response, 200, {'Content-Type': 'application/json'}
+        # a zone which is on keeps recording after the request is withdrawn, until it's off
+        zone.session_requested = record.lower() == "true"
+        update_session(zone)
+    return OK_RESPONSE
+
+@app.route(base_url+"/sessions/<name>", methods = ["GET"])
+def get_session(name):
+    if SESSION_NAME_PATTERN.fullmatch(name) is None:
+        return BAD_REQUEST_RESPONSE
+    start = request.args.get("start", default=0, type=int)
+    count = request.args.get("count", default=3600, type=int)
+    try:
+        total, records = read_session(f"{sessions_dir}/{name}{SESSION_EXTENSION}", start, min(count, 3600))
+    except FileNotFoundError:
+        return NOT_FOUND_RESPONSE
+    except ValueError:
+        # not a session file or one with a different record layout
+        return BAD_REQUEST_RESPONSE
+    response = {}
+    response["name"] = name
+    response["records"] = total
+    response.update(records)
+    return json.dumps(response), 200, {'Content-Type': 'application/json'}
+
+@app.route(base_url+"/metrics", methods = ["GET"])
+def get_metrics():
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
+@app.before_request
+def start_request_timer():
+    g.request_started = perf_counter()
+
+# a teardown also runs for requests which failed with an unhandled exception, they are counted too
+@app.teardown_request
+def observe_request_time(exception):
+    if "request_started" not in g:
+        return
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    key = (route, request.method)
+    summary = request_seconds.get(key)
+    if summary is None:
+        summary = metrics.summary("brew_request_seconds", "Time spent handling HTTP requests", route=route, method=request.method)
+        request_seconds[key] = summary
+    summary.observe(perf_counter() - g.request_started)
+
+@app.after_request
+def compress_response(response):
+    # event streams are never buffered, snapshots arrive compressed already
+    if (response.is_streamed or response.direct_passthrough or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    response.vary.add("Accept-Encoding")
+    body = response.get_data()
+    if len(body) < GZIP_MIN_SIZE or not accepts_gzip():
+        return response
+    response.set_data(gzip.compress(body, compresslevel=GZIP_LEVEL))
+    response.headers["Content-Encoding"] = "gzip"
+    return response
 
 @app.route(base_url+"/health", methods = ["GET"])
 def health():
     return "{\"status\": \"up\"}", 200, {'Content-Type': 'application/json'}
 
-def save_chart_data():
-    timestamps.append(get_current_timestamp())
-    temperature_history.append(None if has_temperature_sensor_error else temperature)
-    setpoint_history.append(None if pid is None else setpoint)
-    duty_cycle_history.append(duty_cycle)
-
-    if len(timestamps) > 3600:
-        timestamps.pop(0)
-        temperature_history.pop(0)
-        setpoint_history.pop(0)
-        duty_cycle_history.pop(0)
-
-def handle_pid():
-    if pid is None:
+def save_chart_data(zone):
+    if not is_record_due:
+        return
+    state = None if zone.pid is None else zone.pid.state
+    zone.chart_history.append(get_current_timestamp(),
+                              None if zone.has_temperature_sensor_error else zone.temperature,
+                              None if state is None else zone.setpoint,
+                              zone.duty_cycle,
+                              None if state is None else state.p,
+                              None if state is None else state.i,
+                              None if state is None else state.d,
+                              zone.estimated_temperature,
+                              None if state is None else zone.control_temperature)
+
+def update_session(zone):
+    # a session covers the time a zone is on, or was explicitly asked to record
+    recording = zone.mode != "off" or zone.session_requested
+    if recording and zone.session_writer is None:
+        name = f"{get_current_timestamp()}{'' if zone is zones[0] else '-' + zone.name}"
+        zone.session_writer = SessionWriter(f"{sessions_dir}/{name}{SESSION_EXTENSION}", max_sessions=max_sessions,
+                                            max_bytes=max_session_bytes)
+        zone.session_writer.start()
+        log_info(zone_text(zone, f"Session {name} started"))
+    elif not recording and zone.session_writer is not None:
+        # the writer syncs the last records on its own thread, the control loop doesn't wait for the SD card
+        zone.session_writer.stop(wait=False)
+        zone.session_writer = None
+        log_info(zone_text(zone, "Session stopped"))
+
+def save_session_data(zone):
+    update_session(zone)
+    if zone.session_writer is None or not is_record_due:
         return
-    global duty_cycle
-    duty_cycle = pid.calc(temperature, setpoint)
+    state = None if zone.pid is None else zone.pid.state
+    p, i, d = (None, None, None) if state is None else (state.p, state.i, state.d)
+    zone.session_writer.append(get_current_timestamp(),
+                               None if zone.has_temperature_sensor_error else zone.temperature,
+                               None if zone.pid is None else zone.setpoint,
+                               zone.duty_cycle, zone.mode, pump, p, i, d)
+
+def zone_checkpoint(zone):
+    return dict(mode=zone.mode, setpoint=zone.setpoint, duty_cycle=zone.duty_cycle, boil_achieved=zone.boil_achieved,
+                pid=None if zone.pid is None else zone.pid.checkpoint())
+
+def write_checkpoint():
+    global last_checkpoint_zones, last_checkpoint_timestamp, last_checkpoint_resumable
+    timestamp = get_current_timestamp()
+    checkpoint_zones = {zone.name: zone_checkpoint(zone) for zone in zones}
+    resumable = any(state["mode"] in RESUMABLE_MODES for state in checkpoint_zones.values())
+    # every write wears the SD card, with nothing to resume the file only needs to say so once
+    if not resumable and not last_checkpoint_resumable:
+        return
+    # an unchanged checkpoint is only rewritten before it gets too old to resume from
+    if checkpoint_zones == last_checkpoint_zones and timestamp - last_checkpoint_timestamp < checkpoint_max_age * 1000 / 2:
+        return
+    checkpoint = dict(timestamp=timestamp, zones=checkpoint_zones)
+    checkpoint_writer.submit(json.dumps(checkpoint).encode())
+    last_checkpoint_zones = checkpoint_zones
+    last_checkpoint_timestamp = timestamp
+    last_checkpoint_resumable = resumable
+
+def save_checkpoint():
+    global checkpoint_elapsed
+    checkpoint_elapsed += control_dt
+    if checkpoint_elapsed < checkpoint_interval:
+        return
+    checkpoint_elapsed = 0.0
+    write_checkpoint()
 
-def handle_autotune():
-    global tuner
+def checkpoint_number(state, key, optional=False):
+    value = state[key]
+    if value is None and optional:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not isfinite(value):
+        raise ValueError(f"{key} must be a finite number")
+    return value
+
+def parse_checkpoint(checkpoint):
+    """Get the zone states to resume as (zone, state) pairs, raises `KeyError`,
+    `TypeError` or `ValueError` for a checkpoint which doesn't look like one
+    `write_checkpoint()` wrote."""
+    age = (get_current_timestamp() - checkpoint_number(checkpoint, "timestamp")) / 1000
+    if age > checkpoint_max_age:
+        log_info(f"Controller checkpoint is {age:.0f} s old, starting off")
+        return []
+    resumed = []
+    for name, state in checkpoint["zones"].items():
+        zone = zones_by_name.get(name)
+        # tuning starts over, it can't be resumed
+        if zone is None or state["mode"] not in RESUMABLE_MODES:
+            continue
+        if not isinstance(state["boil_achieved"], bool):
+            raise ValueError("boil_achieved must be true or false")
+        pid_state = state["pid"]
+        if pid_state is not None:
+            pid_state = dict(integral=checkpoint_number(pid_state, "integral"),
+                             last_input=checkpoint_number(pid_state, "last_input", optional=True),
+                             last_output=checkpoint_number(pid_state, "last_output"))
+        resumed.append((zone, dict(mode=state["mode"], setpoint=checkpoint_number(state, "setpoint"),
+                                   duty_cycle=checkpoint_number(state, "duty_cycle"),
+                                   boil_achieved=state["boil_achieved"], pid=pid_state)))
+    return resumed
+
+def restore_checkpoint():
+    try:
+        with open(checkpoint_writer.path, 'r') as file:
+            checkpoint = json.load(file)
+        # everything is checked before any zone is touched, a broken checkpoint resumes nothing
+        resumed = parse_checkpoint(checkpoint)
+    except FileNotFoundError:
+        return
+    except Exception:
+        log_error("Failed reading the controller checkpoint, starting off!")
+        log_error(traceback.format_exc())
+        return
+    for zone, state in resumed:
+        zone.mode = state["mode"]
+        zone.setpoint = state["setpoint"]
+        zone.duty_cycle = state["duty_cycle"]
+        zone.boil_achieved = state["boil_achieved"]
+        if zone.mode == "auto":
+            initialize_pid(zone)
+            if state["pid"] is not None:
+                zone.pid.restore(state["pid"])
+        log_info(zone_text(zone, f"Resumed {zone.mode} mode from checkpoint"))
+
+def estimate_temperature(zone):
+    if zone.predictor is not None:
+        # the model is driven with the duty cycle the heater had since the previous tick
+        zone.predictor.update(zone.duty_cycle, control_dt)
+    if zone.has_temperature_sensor_error:
+        if zone.estimator is not None:
+            zone.estimator.reset()
+        zone.estimator_timestamp = None
+        zone.estimated_temperature = zone.estimated_rate = zone.control_temperature = None
+        return
+    temperature = zone.temperature
+    if zone.estimator is not None:
+        reading = zone.reading
+        # readings arrive once per sample time, the control loop may tick faster
+        if reading.timestamp != zone.estimator_timestamp:
+            dt = 0.0 if zone.estimator_timestamp is None else reading.timestamp - zone.estimator_timestamp
+            step = RESOLUTION_STEPS[reading.resolution or DEFAULT_RESOLUTION]
+            zone.estimator.update(reading.temperature, dt, step)
+            zone.estimator_timestamp = reading.timestamp
+        temperature = zone.estimator.temperature(clock.monotonic() - reading.timestamp)
+        zone.estimated_temperature = temperature
+        zone.estimated_rate = zone.estimator.rate
+    if zone.predictor is not None:
+        temperature += zone.predictor.correction
+    zone.control_temperature = temperature
+
+def handle_pid(zone):
+    if zone.pid is None:
+        return
+    # readings arrive once per sample time, the control loop may tick faster; a raw reading is a step which the
+    # derivative takes over the time between readings, an estimate moves every tick
+    timestamp = zone.reading.timestamp
+    new_input = zone.estimator is not None or timestamp != zone.pid_input_timestamp
+    zone.pid_input_timestamp = timestamp
+    zone.duty_cycle = zone.pid.calc(zone.control_temperature, zone.setpoint, control_dt, new_input)
+
+def handle_autotune(zone):
+    tuner = zone.tuner
     if tuner is None:
         return
-    global duty_cycle
-    tuner.run(temperature)
-    duty_cycle = tuner.output
-    global peak_count
+    tuner.run(zone.temperature)
+    zone.duty_cycle = tuner.output
     new_peak_count = tuner.peak_count
-    if new_peak_count != peak_count:
-        peak_count = new_peak_count
-        log_info(f"Autotune peak count: {peak_count}")
+    if new_peak_count != zone.peak_count:
+        zone.peak_count = new_peak_count
+        log_info(zone_text(zone, f"Autotune peak count: {zone.peak_count}"))
     if tuner.state == PIDAutotune.STATE_SUCCEEDED or tuner.state == PIDAutotune.STATE_FAILED or tuner.state == PIDAutotune.STATE_OFF:
-        buzz()
+        buzz(Buzzer.DOUBLE_BEEP if tuner.state == PIDAutotune.STATE_SUCCEEDED else Buzzer.REPEATED_BEEP)
         message = None
         if tuner.state == PIDAutotune.STATE_SUCCEEDED:
-            message = dict(text="Autotune successful", style="success")
-            global k_p
-            global k_i
-            global k_d
+            message = dict(text=zone_text(zone, "Autotune successful"), style="success")
+            if isinstance(tuner, StepAutotune):
+                log_info(zone_text(zone, f"Model: slope {tuner.model.slope}, time constant {tuner.model.time_constant}, dead time {tuner.model.dead_time}"))
+                # the Smith predictor uses the latest model
+                zone.model = tuner.model
+                configure_estimator(zone)
             
             for tuning_mode in tuner.tuning_rules:
                 params = tuner.get_pid_parameters(tuning_mode)
@@ -463,115 +928,196 @@ def handle_autotune():
                 log_info(F"Kd: {params.Kd}")
 
                 if tuning_mode == selected_tuning_mode:
-                    k_p = params.Kp
-                    k_i = params.Ki
-                    k_d = params.Kd
+                    zone.k_p = params.Kp
+                    zone.k_i = params.Ki
+                    zone.k_d = params.Kd
 
-            tuner = None
+            zone.tuner = None
             save_settings()
         elif tuner.state == PIDAutotune.STATE_FAILED:
-            message = dict(text="Autotune failed", style="error")
-        set_mode("off")
+            message = dict(text=zone_text(zone, "Autotune failed"), style="error")
+        set_mode(zone, "off")
         if not message is None:
             log_info(message["text"])
-            messages.append(message)
+            add_message(message)
 
 def get_cpu_temperature():
     try:
-        with open('/sys/class/thermal/thermal_zone0/temp') as file:
-            return float(file.read().strip())/1000
+        return int(cpu_temperature_file.read())/1000
     except Exception:
         return None
 
 def get_ip():
+    if netifaces is None:
+        return None
     try:
         return netifaces.ifaddresses('wlan0')[2][0]['addr']
     except Exception:
         return None
 
-def get_temperature():
-    global has_temperature_sensor_error
-    global temperature
-
-    try:
-        base_dir = '/sys/bus/w1/devices/'
-        device_folder = glob.glob(base_dir + '28*')[0]
-        device_file = device_folder + '/w1_slave'
-        with open(device_file, 'r') as file:
-            result = re.search('.*t=(-?\d+).*', file.read())
-            if result is None:
-                has_temperature_sensor_error = True
-
-            else:
-                temperature = float(result.group(1))/1000
-                has_temperature_sensor_error = False
-    except Exception:
-        has_temperature_sensor_error = True
-
-    if has_temperature_sensor_error and mode != "off":
-        message = dict(text="Temperature sensor error, turning off!", style="error")
+def get_temperature(zone):
+    reading = temperature_sampler.reading(zone.sensor)
+    zone.reading = reading
+    zone.is_temperature_stale = not reading.error and temperature_sampler.is_stale(reading)
+    zone.has_temperature_sensor_error = reading.error or zone.is_temperature_stale
+    if not zone.has_temperature_sensor_error:
+        zone.temperature = reading.temperature
+
+    if zone.has_temperature_sensor_error and zone.mode != "off":
+        text = "Temperature sensor reading stale, turning off!" if zone.is_temperature_stale else "Temperature sensor error, turning off!"
+        message = dict(text=zone_text(zone, text), style="error")
         log_error(message["text"])
-        messages.append(message)
-        set_mode("off")
+        add_message(message)
+        set_mode(zone, "off")
 
 
-def set_heater_pwm():
-    global previous_duty_cycle
-    if previous_duty_cycle == duty_cycle:
+def select_resolution(zone):
+    if zone.sensor is None:
         return
-    previous_duty_cycle = duty_cycle
-    log_info(f"Setting heater duty cycle to {duty_cycle}")
-    heater_pwm.change_duty_cycle(duty_cycle)
+    # whether the output is saturated depends on the gains, not on how far the temperature is from the setpoint
+    saturated = zone.mode == "auto" and zone.pid is not None and zone.pid.is_saturated
+    zone.saturated_elapsed = zone.saturated_elapsed + control_dt if saturated else 0.0
+    if zone.mode == "boil":
+        # boiling only compares against the boil threshold
+        coarse = True
+    elif zone.mode == "auto":
+        # fine readings come back as soon as the output leaves the limit
+        coarse = zone.saturated_elapsed >= coarse_resolution_delay
+    else:
+        # tuning and manual control read as precisely as possible
+        coarse = False
+    resolution = COARSE_RESOLUTION if coarse else FINE_RESOLUTION
+    if resolution != zone.sensor_resolution:
+        zone.sensor_resolution = resolution
+        temperature_sampler.request_resolution(zone.sensor, resolution)
+
+def set_heater_pwm(zone):
+    if zone.previous_duty_cycle == zone.duty_cycle:
+        return
+    zone.previous_duty_cycle = zone.duty_cycle
+    log_info(zone_text(zone, f"Setting heater duty cycle to {zone.duty_cycle}"))
+    zone.heater(zone.duty_cycle)
 
 def set_fan_power():
     log_info(f"Setting fan power to {fan_power}")
-    fan_pwm.change_duty_cycle(fan_power)
+    hardware.set_fan(fan_power)
 
-def handle_alarm():
-    global alarm_armed
-    if alarm_armed and ((previous_temperature < setpoint and temperature >= setpoint) or (previous_temperature > setpoint and temperature <= setpoint)):
+def handle_alarm(zone):
+    previous_temperature = zone.previous_temperature
+    temperature = zone.temperature
+    setpoint = zone.setpoint
+    if zone.alarm_armed and ((previous_temperature < setpoint and temperature >= setpoint) or (previous_temperature > setpoint and temperature <= setpoint)):
         buzz()
-        alarm_armed = False
+        zone.alarm_armed = False
 
 def handle_time():
     global previous_time
-    global timestamps
-    global temperature_history
-    global setpoint_history
-    global duty_cycle_history
-    new_time = time.time()
+    new_time = clock.time()
     if new_time < previous_time or new_time - previous_time > 5:
         log_info("Time jump detected, emptying charts")
-        timestamps = []
-        temperature_history = []
-        setpoint_history = []
-        duty_cycle_history = []
+        for zone in zones:
+            zone.chart_history.clear()
     previous_time = new_time
 
-def loop():
+def for_each_zone(stage):
+    def run():
+        for zone in zones:
+            stage(zone)
+    run.__name__ = stage.__name__
+    return run
+
+control_stages = [
+    handle_time,
+    for_each_zone(get_temperature),
+    for_each_zone(estimate_temperature),
+    for_each_zone(handle_pid),
+    for_each_zone(handle_boil),
+    for_each_zone(handle_autotune),
+    for_each_zone(select_resolution),
+    for_each_zone(set_heater_pwm),
+    for_each_zone(handle_alarm),
+    calculate_fan_rpm,
+    for_each_zone(save_chart_data),
+    for_each_zone(save_session_data),
+    save_checkpoint,
+    for_each_zone(publish_status_snapshot),
+    publish_info_snapshot
+]
+stage_seconds = [metrics.summary("brew_stage_seconds", "Time spent in a control loop stage", stage=stage.__name__) for stage in control_stages]
+encode_seconds = metrics.summary("brew_stage_seconds", "Time spent in a control loop stage", stage="encode_status")
+
+def loop(dt):
+    tick_started = perf_counter()
+    tick_lateness_seconds.observe(control_scheduler.lateness / clock.speed)
     with lock:
-        global previous_temperature
-        previous_temperature = temperature
-        handle_time()
-        get_temperature()
-        handle_pid()
-        handle_boil()
-        handle_autotune()
-        set_heater_pwm()
-        handle_alarm()
-        calculate_fan_rpm()
-        save_chart_data()
-
-load_settings()
+        global control_dt
+        global record_elapsed
+        global is_record_due
+        for zone in zones:
+            zone.previous_temperature = zone.temperature
+        control_dt = dt
+        # the control period can be shorter than the sample time, history is still recorded once per sample time
+        record_elapsed += dt
+        is_record_due = record_elapsed >= sample_time - control_period / 2
+        if is_record_due:
+            record_elapsed = 0.0
+        for stage, seconds in zip(control_stages, stage_seconds):
+            with seconds.time():
+                stage()
+        delta_snapshots = [(zone, zone.status_snapshot[2]) for zone in zones]
+    # encoding once here serves both the stream and clients polling for the last sample
+    for zone, delta_snapshot in delta_snapshots:
+        with encode_seconds.time():
+            body, _ = delta_snapshot.encode()
+        if broadcaster.subscriber_count > 0:
+            broadcaster.publish_frame(status_event_names[zone.name] + body + b"\n\n")
+    tick_duration = perf_counter() - tick_started
+    tick_seconds.observe(tick_duration)
+    if tick_duration > control_period / clock.speed:
+        tick_overruns.inc()
+
+create_zones()
+# the first zone keeps the plain status event, so clients which don't know about zones follow it
+status_event_names = {zone.name: f"event: status{'' if index == 0 else '-' + zone.name}\ndata: ".encode() for index, zone in enumerate(zones)}
+zone_sensors = [zone.sensor for zone in zones if zone.sensor is not None]
+load_settings(stored_settings)
 
 start_millis = get_current_timestamp()
-previous_time = time.time()
+previous_time = clock.time()
+
+restore_checkpoint()
 
-scheduler = BackgroundScheduler()
-scheduler.add_job(func=loop, trigger="interval", seconds=1)
-scheduler.start()
+for zone in zones:
+    publish_status_snapshot(zone)
+publish_info_snapshot()
 
-atexit.register(lambda: scheduler.shutdown())
+temperature_sampler.start()
+# a resumed controller needs a temperature on its first tick
+temperature_sampler.wait_ready(3 * sample_time)
+buzzer.start()
+settings_store.start()
+checkpoint_writer.start()
 
+control_scheduler = ControlScheduler(loop, control_period, on_overrun=missed_ticks.inc, clock=clock)
+control_scheduler.start()
+
+def shutdown():
+    # gunicorn's worker_exit hook runs this before the interpreter waits for the request threads
+    atexit.unregister(shutdown)
+    broadcaster.close()
+    control_scheduler.stop()
+    with lock:
+        write_checkpoint()
+    checkpoint_writer.stop()
+    settings_store.stop()
+    temperature_sampler.stop()
+    buzzer.stop()
+    for zone in zones:
+        if zone.session_writer is not None:
+            zone.session_writer.stop()
+
+atexit.register(shutdown)
+
+# the development server, gunicorn.conf.py configures the production one
 if __name__ == '__main__':
     app.run(threaded = True, host="0.0.0.0")
@@ -3,6 +3,55 @@ import logging
 from time import time
 from collections import deque, namedtuple
 
+class _SlidingExtrema(object):
+    """The maximum and minimum of the last `size` values.
+
+    Each deque holds the values which can still become the extremum as older
+    values leave the window, monotonically ordered, so pushing is amortized
+    O(1) and the extrema are at the front.
+    """
+
+    def __init__(self, size):
+        self._size = size
+        self._count = 0
+        self._maxima = deque()
+        self._minima = deque()
+
+    def __len__(self):
+        return min(self._count, self._size)
+
+    @property
+    def maxlen(self):
+        return self._size
+
+    @property
+    def max(self):
+        return self._maxima[0][1]
+
+    @property
+    def min(self):
+        return self._minima[0][1]
+
+    def append(self, value):
+        index = self._count
+        self._count += 1
+        while self._maxima and self._maxima[-1][1] <= value:
+            self._maxima.pop()
+        self._maxima.append((index, value))
+        while self._minima and self._minima[-1][1] >= value:
+            self._minima.pop()
+        self._minima.append((index, value))
+        oldest = index - self._size
+        if self._maxima[0][0] <= oldest:
+            self._maxima.popleft()
+        if self._minima[0][0] <= oldest:
+            self._minima.popleft()
+
+    def clear(self):
+        self._count = 0
+        self._maxima.clear()
+        self._minima.clear()
+
 class PIDAutotune(object):
     """Determines viable parameters for a PID controller.
 
@@ -17,6 +66,10 @@ class PIDAutotune(object):
         noiseband (float): Determines by how much the input value must
             overshoot/undershoot the setpoint before the state changes.
         time (function): A function which returns the current time in seconds.
+        hysteresis (float): How far a peak must be from the previous one to
+            count, smaller swings are treated as noise.
+        filter_time (float): Time constant of a low pass filter applied to
+            the input before looking for peaks, in seconds.
     """
     PIDParams = namedtuple('PIDParams', ['Kp', 'Ki', 'Kd'])
 
@@ -38,7 +91,8 @@ class PIDAutotune(object):
     }
 
     def __init__(self, sampletime, setpoint, out_step=10, lookback=60,
-                 out_min=0.0, out_max=100.0, noiseband=0.5, time=time):
+                 out_min=0.0, out_max=100.0, noiseband=0.5, time=time,
+                 hysteresis=0.0, filter_time=0.0):
         if setpoint is None:
             raise ValueError('setpoint must be specified')
         if out_step < 1:
@@ -49,10 +103,17 @@ class PIDAutotune(object):
             raise ValueError('lookback must be greater or equal to sampletime')
         if out_min >= out_max:
             raise ValueError('out_min must be less than out_max')
+        if hysteresis < 0:
+            raise ValueError('hysteresis must be greater or equal to 0')
+        if filter_time < 0:
+            raise ValueError('filter_time must be greater or equal to 0')
 
         self._time = time
         self._logger = logging.getLogger(type(self).__name__)
-        self._inputs = deque(maxlen=round(lookback / sampletime))
+        self._inputs = _SlidingExtrema(round(lookback / sampletime))
+        self._hysteresis = hysteresis
+        self._filter_factor = sampletime / (filter_time + sampletime)
+        self._filtered_input = None
         self._sampletime = sampletime * 1000
         self._setpoint = setpoint
         self._outputstep = out_step
@@ -124,13 +185,13 @@ class PIDAutotune(object):
         if (self._state == PIDAutotune.STATE_RELAY_STEP_UP
                 and input_val > self._setpoint + self._noiseband):
             self._state = PIDAutotune.STATE_RELAY_STEP_DOWN
-            self._logger.debug('switched state: {0}'.format(self._state))
-            self._logger.debug('input: {0}'.format(input_val))
+            self._logger.debug('switched state: %s', self._state)
+            self._logger.debug('input: %s', input_val)
         elif (self._state == PIDAutotune.STATE_RELAY_STEP_DOWN
                 and input_val < self._setpoint - self._noiseband):
             self._state = PIDAutotune.STATE_RELAY_STEP_UP
-            self._logger.debug('switched state: {0}'.format(self._state))
-            self._logger.debug('input: {0}'.format(input_val))
+            self._logger.debug('switched state: %s', self._state)
+            self._logger.debug('input: %s', input_val)
 
         # set output
         if (self._state == PIDAutotune.STATE_RELAY_STEP_UP):
@@ -142,13 +203,17 @@ class PIDAutotune(object):
         self._output = min(self._output, self._out_max)
         self._output = max(self._output, self._out_min)
 
-        # identify peaks
-        is_max = True
-        is_min = True
+        # the relay works on the raw input, only peak detection is filtered
+        if self._filter_factor < 1:
+            if self._filtered_input is None:
+                self._filtered_input = input_val
+            else:
+                self._filtered_input += self._filter_factor * (input_val - self._filtered_input)
+            input_val = self._filtered_input
 
-        for val in self._inputs:
-            is_max = is_max and (input_val >= val)
-            is_min = is_min and (input_val <= val)
+        # identify peaks
+        is_max = len(self._inputs) == 0 or input_val >= self._inputs.max
+        is_min = len(self._inputs) == 0 or input_val <= self._inputs.min
 
         self._inputs.append(input_val)
 
@@ -171,13 +236,18 @@ class PIDAutotune(object):
                 inflection = True
             self._peak_type = -1
 
+        # swings smaller than the hysteresis don't count as a new peak
+        if inflection and self._peaks and abs(input_val - self._peaks[-1]) < self._hysteresis:
+            inflection = False
+            self._peak_type = -self._peak_type
+
         # update peak times and values
         if inflection:
             self._peak_count += 1
             self._peaks.append(input_val)
             self._peak_timestamps.append(now)
-            self._logger.debug('found peak: {0}'.format(input_val))
-            self._logger.debug('peak count: {0}'.format(self._peak_count))
+            self._logger.debug('found peak: %s', input_val)
+            self._logger.debug('peak count: %s', self._peak_count)
 
         # check for convergence of induced oscillation
         # convergence of amplitude assessed on last 4 peaks (1.5 cycles)
@@ -197,8 +267,8 @@ class PIDAutotune(object):
             amplitude_dev = ((0.5 * (abs_max - abs_min) - self._induced_amplitude)
                              / self._induced_amplitude)
 
-            self._logger.debug('amplitude: {0}'.format(self._induced_amplitude))
-            self._logger.debug('amplitude deviation: {0}'.format(amplitude_dev))
+            self._logger.debug('amplitude: %s', self._induced_amplitude)
+            self._logger.debug('amplitude deviation: %s', amplitude_dev)
 
             if amplitude_dev < PIDAutotune.PEAK_AMPLITUDE_TOLERANCE:
                 self._state = PIDAutotune.STATE_SUCCEEDED
@@ -231,7 +301,253 @@ class PIDAutotune(object):
         self._Ku = 0
         self._Pu = 0
         self._inputs.clear()
+        self._filtered_input = None
         self._peaks.clear()
         self._peak_timestamps.clear()
         self._peak_timestamps.append(timestamp)
-        self._state = PIDAutotune.STATE_RELAY_STEP_UP
\ No newline at end of file
+        self._state = PIDAutotune.STATE_RELAY_STEP_UP
+
+class _RecursiveLeastSquares(object):
+    """Least squares estimate of `y = phi . theta` updated one sample at a time."""
+
+    def __init__(self, size, initial_covariance=1e6):
+        self._theta = [0.0] * size
+        self._p = [[initial_covariance if row == column else 0.0 for column in range(size)] for row in range(size)]
+        self._squared_error = 0.0
+
+    @property
+    def theta(self):
+        return self._theta
+
+    @property
+    def squared_error(self):
+        """The sum of the squared a priori prediction errors."""
+        return self._squared_error
+
+    def update(self, phi, y):
+        p = self._p
+        size = len(phi)
+        p_phi = [sum(p[row][column] * phi[column] for column in range(size)) for row in range(size)]
+        denominator = 1.0 + sum(phi[row] * p_phi[row] for row in range(size))
+        gain = [value / denominator for value in p_phi]
+        error = y - sum(phi[row] * self._theta[row] for row in range(size))
+        self._squared_error += error * error
+        self._theta = [self._theta[row] + gain[row] * error for row in range(size)]
+        # P is symmetric, so P.phi is also the transposed phi.P
+        for row in range(size):
+            for column in range(size):
+                p[row][column] -= gain[row] * p_phi[column]
+        return error
+
+class StepAutotune(object):
+    """Determines PID parameters from a single step response.
+
+    The output is stepped up until the input gets close to the setpoint,
+    while a first order plus dead time model is fitted online. The integrated
+    model `T - T0 = -1/tau * int(T - T0) + K/tau * int(u(t - dead_time)) + c * t`
+    is linear in its parameters and fitted with recursive least squares for
+    every candidate dead time, the candidate with the smallest prediction
+    error wins. Tuning succeeds once the estimate has settled, usually long
+    before the setpoint is reached.
+
+    Args:
+        sampletime (float): The interval between run() calls.
+        setpoint (float): The value the step must not exceed.
+        out_step (float): The output during the step.
+        lookback (float): How long the estimate must be stable to succeed.
+        max_dead_time (float): The longest dead time which is considered.
+        max_duration (float): How long the step may take before tuning fails.
+        min_rise (float): How far the input must rise before the estimate
+            is trusted.
+        out_min (float): Lower output limit.
+        out_max (float): Upper output limit.
+        noiseband (float): How far below the setpoint the step ends.
+        tolerance (float): The relative change of the estimate over the
+            lookback period below which it counts as settled.
+        time (function): A function which returns the current time in seconds.
+    """
+    PIDParams = PIDAutotune.PIDParams
+    Model = namedtuple('Model', ['slope', 'time_constant', 'dead_time'])
+
+    STATE_OFF = PIDAutotune.STATE_OFF
+    STATE_STEP = 'step'
+    STATE_SUCCEEDED = PIDAutotune.STATE_SUCCEEDED
+    STATE_FAILED = PIDAutotune.STATE_FAILED
+
+    # a time constant this many times longer than the dead time is treated as an integrating process
+    INTEGRATING_RATIO = 8
+
+    TUNING_RULES = ('simc', 'imc')
+
+    def __init__(self, sampletime, setpoint, out_step=100, lookback=60,
+                 max_dead_time=120, max_duration=7200, min_rise=2.0,
+                 out_min=0.0, out_max=100.0, noiseband=0.5, tolerance=0.05,
+                 time=time):
+        if setpoint is None:
+            raise ValueError('setpoint must be specified')
+        if out_step <= 0:
+            raise ValueError('out_step must be greater than 0')
+        if sampletime <= 0:
+            raise ValueError('sampletime must be greater than 0')
+        if lookback < sampletime:
+            raise ValueError('lookback must be greater or equal to sampletime')
+        if max_dead_time < 0:
+            raise ValueError('max_dead_time must be greater or equal to 0')
+        if out_min >= out_max:
+            raise ValueError('out_min must be less than out_max')
+
+        self._time = time
+        self._logger = logging.getLogger(type(self).__name__)
+        self._sampletime = sampletime
+        self._setpoint = setpoint
+        self._outputstep = out_step
+        self._lookback = round(lookback / sampletime)
+        self._max_delay = round(max_dead_time / sampletime)
+        self._max_duration = max_duration
+        self._min_rise = min_rise
+        self._out_min = out_min
+        self._out_max = out_max
+        self._noiseband = noiseband
+        self._tolerance = tolerance
+        self._state = StepAutotune.STATE_OFF
+        self._output = 0
+        self._last_run_timestamp = 0
+        self._model = None
+
+    @property
+    def state(self):
+        return self._state
+
+    @property
+    def output(self):
+        return self._output
+
+    @property
+    def peak_count(self):
+        # a step response has no peaks, the property keeps the interface of PIDAutotune
+        return 0
+
+    @property
+    def model(self):
+        """The fitted `Model`, `None` until tuning succeeded.
+
+        The slope is how fast the input changes per unit of output in the
+        beginning, the steady state gain is the slope times the time constant,
+        which is infinite for an integrating process.
+        """
+        return self._model
+
+    @property
+    def tuning_rules(self):
+        return StepAutotune.TUNING_RULES
+
+    def get_pid_parameters(self, tuning_rule='simc'):
+        """Get PID parameters.
+
+        Args:
+            tuning_rule (str): `simc` for Skogestad's PI rule with a closed
+                loop time constant equal to the dead time, `imc` for the
+                Rivera IMC PID rule with a filter time constant of twice the
+                dead time.
+        """
+        if tuning_rule not in StepAutotune.TUNING_RULES:
+            raise KeyError(tuning_rule)
+        slope, time_constant, dead_time = self._model
+        # sampling adds half a sample time of delay
+        dead_time += self._sampletime / 2
+        # the slope is all that is known reliably about a slow process
+        integrating = time_constant > StepAutotune.INTEGRATING_RATIO * dead_time
+        if tuning_rule == 'simc':
+            kp = 1 / (slope * 2 * dead_time)
+            ti = min(time_constant, 8 * dead_time)
+            td = 0.0
+        elif integrating:
+            filter_time = 2 * dead_time
+            kp = (2 * filter_time + dead_time) / (slope * (filter_time + dead_time / 2) ** 2)
+            ti = 2 * filter_time + dead_time
+            td = (filter_time * dead_time + dead_time ** 2 / 4) / (2 * filter_time + dead_time)
+        else:
+            filter_time = 2 * dead_time
+            kp = (2 * time_constant + dead_time) / (slope * time_constant * (2 * filter_time + dead_time))
+            ti = time_constant + dead_time / 2
+            td = time_constant * dead_time / (2 * time_constant + dead_time)
+        return StepAutotune.PIDParams(kp, kp / ti, kp * td)
+
+    def run(self, input_val):
+        """To autotune a system, this method must be called periodically.
+
+        Args:
+            input_val (float): The input value.
+
+        Returns:
+            `true` if tuning is finished, otherwise `false`.
+        """
+        now = self._time()
+
+        if self._state != StepAutotune.STATE_STEP:
+            self._init_tuner(input_val)
+            self._last_run_timestamp = now
+            return False
+        dt = now - self._last_run_timestamp
+        if dt < self._sampletime:
+            return False
+        self._last_run_timestamp = now
+
+        # the model is driven by the outputs which were applied before this sample, integrated over the actual
+        # time between samples, dead times are counted in samples
+        self._elapsed += dt
+        self._integrated_input += (self._previous_input - self._initial_input) * dt
+        self._outputs.appendleft(self._output)
+        for delay, estimator in enumerate(self._estimators):
+            if delay < len(self._outputs):
+                self._integrated_outputs[delay] += self._outputs[delay] * dt
+            estimator.update((self._integrated_input, self._integrated_outputs[delay], self._elapsed),
+                             input_val - self._initial_input)
+        self._previous_input = input_val
+
+        best_delay = min(range(len(self._estimators)), key=lambda delay: self._estimators[delay].squared_error)
+        slope = self._estimators[best_delay].theta[1]
+        self._history.append((best_delay, slope))
+        rise = input_val - self._initial_input
+        reached_setpoint = input_val >= self._setpoint - self._noiseband
+
+        if rise >= self._min_rise and (reached_setpoint or self._is_settled()):
+            alpha, slope, _ = self._estimators[best_delay].theta
+            if slope <= 0:
+                return self._finish(StepAutotune.STATE_FAILED)
+            time_constant = -1 / alpha if alpha < 0 else math.inf
+            self._model = StepAutotune.Model(slope, time_constant, best_delay * self._sampletime)
+            self._logger.debug('model: %s', self._model)
+            return self._finish(StepAutotune.STATE_SUCCEEDED)
+        if reached_setpoint or self._elapsed >= self._max_duration:
+            return self._finish(StepAutotune.STATE_FAILED)
+
+        self._output = min(self._out_max, max(self._out_min, self._outputstep))
+        return False
+
+    def _is_settled(self):
+        if len(self._history) < self._history.maxlen:
+            return False
+        delays = {delay for delay, _ in self._history}
+        slopes = [slope for _, slope in self._history]
+        mean = sum(slopes) / len(slopes)
+        return len(delays) == 1 and mean > 0 and (max(slopes) - min(slopes)) / mean < self._tolerance
+
+    def _finish(self, state):
+        self._state = state
+        self._output = 0
+        return True
+
+    def _init_tuner(self, input_val):
+        self._state = StepAutotune.STATE_STEP
+        self._output = min(self._out_max, max(self._out_min, self._outputstep))
+        self._model = None
+        self._elapsed = 0.0
+        self._initial_input = input_val
+        self._previous_input = input_val
+        self._integrated_input = 0.0
+        self._outputs = deque(maxlen=self._max_delay + 1)
+        self._integrated_outputs = [0.0] * (self._max_delay + 1)
+        self._estimators = [_RecursiveLeastSquares(3) for _ in range(self._max_delay + 1)]
+        self._history = deque(maxlen=self._lookback)
+
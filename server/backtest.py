@@ -0,0 +1,256 @@
+"""Backtests PID gains against a first order plus dead time model of the
+kettle, which can be fitted to a recorded session.
+
+The controller is simulated the same way `PID.calc` works, for thousands of
+gain combinations at once with NumPy, and each combination is scored by its
+overshoot, settling time, integrated errors and heater energy. NumPy is only
+needed here, the controller itself doesn't import this module, so it's
+installed from requirements-backtest.txt and not with the controller.
+
+Usage:
+    pip3 install -r requirements-backtest.txt
+    python3 backtest.py sessions/1700000000000.session --kp 1,60,30 --ki 0,0.2,21 --kd 0,200,11
+"""
+import argparse
+import json
+import math
+from collections import namedtuple
+
+import numpy as np
+
+from session import read_session
+
+Plant = namedtuple('Plant', ['gain', 'time_constant', 'dead_time', 'ambient'])
+Plant.__doc__ = """A first order plus dead time plant.
+
+The temperature approaches `ambient + gain * duty_cycle` with the time
+constant in seconds, `dead_time` seconds after the duty cycle changes.
+"""
+
+METRICS = ['overshoot', 'settling_time', 'iae', 'itae', 'energy']
+
+def _finite_or_none(value):
+    value = float(value)
+    return value if math.isfinite(value) else None
+
+def _longest_finite_run(*columns):
+    finite = np.logical_and.reduce([np.isfinite(column) for column in columns])
+    best_start, best_length, start = 0, 0, None
+    for index, value in enumerate(np.append(finite, False)):
+        if value and start is None:
+            start = index
+        elif not value and start is not None:
+            if index - start > best_length:
+                best_start, best_length = start, index - start
+            start = None
+    return slice(best_start, best_start + best_length)
+
+def fit_fopdt(temperature, duty_cycle, sampletime=1.0, max_dead_time=120.0):
+    """Fit a first order plus dead time model to a recorded trace.
+
+    The model `dT/dt = (ambient - T + gain * u(t - dead_time)) / time_constant`
+    is integrated, which makes it linear in its parameters and insensitive to
+    the quantization of the sensor, and fitted with least squares for every
+    dead time up to `max_dead_time`. The dead time with the smallest residual
+    is kept. Only the longest stretch without missing values is used.
+
+    Args:
+        temperature (array): Measured temperatures, NaN where missing.
+        duty_cycle (array): Heater duty cycles in %, NaN where missing.
+        sampletime (float): The interval between samples in seconds.
+        max_dead_time (float): The longest dead time tried in seconds.
+
+    Returns:
+        The fitted `Plant`.
+    """
+    temperature = np.asarray(temperature, dtype=float)
+    duty_cycle = np.asarray(duty_cycle, dtype=float)
+    if temperature.shape != duty_cycle.shape:
+        raise ValueError('temperature and duty_cycle must have the same length')
+    if sampletime <= 0:
+        raise ValueError('sampletime must be greater than 0')
+    run = _longest_finite_run(temperature, duty_cycle)
+    temperature = temperature[run]
+    duty_cycle = duty_cycle[run]
+
+    best = None
+    # integrals from the first sample up to each sample
+    integrated_temperature = np.concatenate([[0.0], np.cumsum(temperature) * sampletime])
+    integrated_duty_cycle = np.concatenate([[0.0], np.cumsum(duty_cycle) * sampletime])
+    for delay in range(0, int(max_dead_time / sampletime) + 1):
+        # the fit starts once the first delayed duty cycle is known
+        count = len(temperature) - delay - 1
+        if count < 10:
+            break
+        y = temperature[delay + 1:] - temperature[delay]
+        x = np.column_stack([integrated_temperature[delay + 1:-1] - integrated_temperature[delay],
+                             integrated_duty_cycle[1:count + 1],
+                             np.arange(1, count + 1) * sampletime])
+        coefficients, residuals, rank, _ = np.linalg.lstsq(x, y, rcond=None)
+        if rank < 3:
+            continue
+        residual = residuals[0] if len(residuals) else 0.0
+        if best is None or residual < best[0]:
+            best = (residual, delay, coefficients)
+
+    if best is None:
+        raise ValueError('the trace is too short or the duty cycle never changes')
+    _, delay, (alpha, beta, gamma) = best
+    if alpha >= 0:
+        raise ValueError('the trace does not show a stable first order response')
+    time_constant = -1 / alpha
+    return Plant(gain=float(beta * time_constant), time_constant=float(time_constant),
+                 dead_time=delay * sampletime, ambient=float(gamma * time_constant))
+
+def gain_grid(kp, ki, kd):
+    """Get every combination of the given gains as an array of (Kp, Ki, Kd) rows."""
+    grid = np.meshgrid(np.asarray(kp, dtype=float), np.asarray(ki, dtype=float), np.asarray(kd, dtype=float), indexing='ij')
+    return np.column_stack([axis.ravel() for axis in grid])
+
+def backtest(plant, gains, setpoint, duration=3600.0, initial_temperature=None,
+             sampletime=1.0, out_min=0.0, out_max=100.0, max_temperature=100.0,
+             band=0.5, heater_power=3000.0):
+    """Simulate a PID controller with every gain combination against a plant.
+
+    The time steps are simulated one after another but all gain combinations
+    at once, and the metrics are accumulated along the way, so memory only
+    grows with the number of combinations.
+
+    Args:
+        plant (Plant): The plant to control.
+        gains (array): Rows of (Kp, Ki, Kd) in the units `PID` takes them.
+        setpoint (float or array): The target temperature, or one per sample.
+        duration (float): Simulated time in seconds, ignored if `setpoint` is
+            an array.
+        initial_temperature (float): The starting temperature, ambient if not
+            specified.
+        sampletime (float): The interval between controller calls in seconds.
+        out_min (float): Lower output limit.
+        out_max (float): Upper output limit.
+        max_temperature (float): Temperature the liquid can't exceed, the
+            boiling point.
+        band (float): How close to the final setpoint the temperature must
+            stay to count as settled.
+        heater_power (float): Heater power at 100% duty cycle in watts, to
+            report the energy in joules.
+
+    Returns:
+        A dict of arrays with one value per gain combination: `kp`, `ki`,
+        `kd`, `overshoot` (°C past the final setpoint), `settling_time`
+        (seconds, infinite if it never settles), `iae`, `itae` and `energy`
+        (joules).
+    """
+    gains = np.atleast_2d(np.asarray(gains, dtype=float))
+    if gains.shape[1] != 3:
+        raise ValueError('gains must have rows of (Kp, Ki, Kd)')
+    if sampletime <= 0:
+        raise ValueError('sampletime must be greater than 0')
+    if plant.time_constant <= 0:
+        raise ValueError('plant time_constant must be greater than 0')
+    setpoints = np.asarray(setpoint, dtype=float)
+    if setpoints.ndim == 0:
+        setpoints = np.full(int(round(duration / sampletime)), float(setpoints))
+    if not np.all(np.isfinite(setpoints)):
+        raise ValueError('setpoint must be finite')
+
+    count = len(gains)
+    kp = gains[:, 0]
+    # the same scaling PID applies to the gains
+    ki = gains[:, 1] * sampletime
+    kd = gains[:, 2] / sampletime
+    decay = math.exp(-sampletime / plant.time_constant)
+    delay = int(round(plant.dead_time / sampletime))
+
+    temperature = np.full(count, plant.ambient if initial_temperature is None else float(initial_temperature))
+    final_setpoint = setpoints[-1]
+    direction = 1.0 if final_setpoint >= temperature[0] else -1.0
+    integral = np.zeros(count)
+    last_input = temperature.copy()
+    last_output = np.zeros(count)
+    # duty cycles which haven't reached the plant yet, used as a ring
+    pending = np.zeros((delay + 1, count))
+
+    overshoot = np.zeros(count)
+    iae = np.zeros(count)
+    itae = np.zeros(count)
+    duty_sum = np.zeros(count)
+    last_unsettled = np.full(count, -1)
+
+    for step, target in enumerate(setpoints):
+        error = target - temperature
+        integrating = (last_output < out_max) & (last_output > out_min)
+        integral = np.where(integrating, np.clip(integral + ki * error, out_min, out_max), integral)
+        output = np.clip(kp * error + integral - kd * (temperature - last_input), out_min, out_max)
+        last_input = temperature
+        last_output = output
+
+        absolute_error = np.abs(error)
+        iae += absolute_error * sampletime
+        itae += step * sampletime * absolute_error * sampletime
+        duty_sum += output * sampletime
+        np.maximum(overshoot, direction * (temperature - final_setpoint), out=overshoot)
+        last_unsettled[np.abs(temperature - final_setpoint) > band] = step
+
+        pending[step % (delay + 1)] = output
+        applied = pending[(step + 1) % (delay + 1)] if delay > 0 else output
+        temperature = np.minimum(plant.ambient + decay * (temperature - plant.ambient)
+                                 + plant.gain * (1 - decay) * applied, max_temperature)
+
+    steps = len(setpoints)
+    settling_time = np.where(last_unsettled >= steps - 1, np.inf, (last_unsettled + 1) * sampletime)
+    return dict(kp=gains[:, 0], ki=gains[:, 1], kd=gains[:, 2],
+                overshoot=overshoot, settling_time=settling_time, iae=iae, itae=itae,
+                energy=duty_sum / 100 * heater_power)
+
+def rank(results, key='itae', count=10):
+    """Get the indices of the best gain combinations by a metric, lowest first."""
+    return np.argsort(results[key], kind='stable')[:count]
+
+def _parse_range(text):
+    values = [float(value) for value in text.split(',')]
+    if len(values) == 1:
+        return np.array(values)
+    if len(values) != 3:
+        raise argparse.ArgumentTypeError('expected a value or start,stop,count')
+    return np.linspace(values[0], values[1], int(values[2]))
+
+def main():
+    parser = argparse.ArgumentParser(description='Backtest PID gains against a plant fitted to a session.')
+    parser.add_argument('session', help='a recorded .session file')
+    parser.add_argument('--kp', type=_parse_range, default='1,60,30', help='a value or start,stop,count')
+    parser.add_argument('--ki', type=_parse_range, default='0,0.2,21', help='a value or start,stop,count')
+    parser.add_argument('--kd', type=_parse_range, default='0,200,11', help='a value or start,stop,count')
+    parser.add_argument('--setpoint', type=float, default=65.0)
+    parser.add_argument('--initial-temperature', type=float)
+    parser.add_argument('--duration', type=float, default=3600.0)
+    parser.add_argument('--heater-power', type=float, default=3000.0)
+    parser.add_argument('--sort', choices=METRICS, default='itae')
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    _, records = read_session(args.session)
+    timestamps = np.asarray(records['timestamp'], dtype=float)
+    sampletime = float(np.median(np.diff(timestamps))) / 1000 if len(timestamps) > 1 else 1.0
+    plant = fit_fopdt(np.asarray(records['temperature'], dtype=float), np.asarray(records['dutyCycle'], dtype=float), sampletime)
+    gains = gain_grid(args.kp, args.ki, args.kd)
+    results = backtest(plant, gains, args.setpoint, args.duration, args.initial_temperature,
+                       sampletime, heater_power=args.heater_power)
+    best = rank(results, args.sort, args.top)
+
+    if args.json:
+        # JSON has no infinity, a combination which never settles has a settling time of null
+        print(json.dumps(dict(plant={name: _finite_or_none(value) for name, value in plant._asdict().items()},
+                              results=[{name: _finite_or_none(values[index]) for name, values in results.items()} for index in best])))
+        return
+    print(f'plant: gain {plant.gain:.4f} °C/%, time constant {plant.time_constant:.0f} s, '
+          f'dead time {plant.dead_time:.0f} s, ambient {plant.ambient:.1f} °C')
+    print(f'{len(gains)} gain combinations, best by {args.sort}:')
+    print(f'{"kp":>8} {"ki":>8} {"kd":>8} {"overshoot":>10} {"settling":>9} {"iae":>10} {"itae":>12} {"energy":>8}')
+    for index in best:
+        print(f'{results["kp"][index]:8.3f} {results["ki"][index]:8.4f} {results["kd"][index]:8.2f} '
+              f'{results["overshoot"][index]:10.2f} {results["settling_time"][index]:9.0f} '
+              f'{results["iae"][index]:10.0f} {results["itae"][index]:12.0f} {results["energy"][index] / 3.6e6:6.2f}kWh')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,425 @@
+"""Load and soak benchmark of the HTTP API against the simulated controller.
+
+Starts the app on simulated hardware in a scratch directory, waits until the
+chart history is at full capacity and then, for the given duration, runs
+pollers which request /api/status, /api/info and /api/messages once a second
+like the UI does, event stream subscribers, bursts of setpoint and pump
+changes and a metrics scraper. Simulated time passes `--speed` times faster
+than real time, so a few minutes cover a brew day of control ticks.
+
+Polls and bursts are paced in simulated time like the ticks, a poller asks
+once per simulated second, so every poll finds one new chart sample and the
+server answers it the way it answers a UI, from the snapshot of the latest
+sample. The request rate grows with the speed, which keeps the ratio of
+requests to ticks that of real UIs.
+
+The report has the throughput and latency quantiles of every endpoint, the
+duration and lateness (jitter) of the control ticks from the app's metrics
+and the memory (RSS) of the server over time. Reports of two releases can be
+compared, regressions beyond a threshold make the comparison fail.
+
+Usage:
+    python3 benchmarks/load.py --pollers 4 --streams 4 --duration 300 --speed 20 --output report.json
+    python3 benchmarks/load.py --compare baseline.json report.json
+"""
+import argparse
+import gzip
+import http.client
+import json
+import os
+import random
+import re
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from urllib.parse import urlencode
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HISTORY_CAPACITY = 3600
+METRIC_PATTERN = re.compile(r'^(\w+)(?:\{([^}]*)\})? (\S+)$')
+REPORT_VERSION = 1
+
+def percentile(values, fraction):
+    """Get a nearest rank percentile of unsorted values, `None` if there are none."""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+class Recorder(object):
+    """Collects the latencies of the requests of all client threads by endpoint."""
+
+    def __init__(self):
+        self._latencies = {}
+        self._errors = {}
+        self._bytes = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, size, ok):
+        with self._lock:
+            self._latencies.setdefault(name, []).append(seconds)
+            self._bytes[name] = self._bytes.get(name, 0) + size
+            if not ok:
+                self._errors[name] = self._errors.get(name, 0) + 1
+
+    def report(self, duration):
+        with self._lock:
+            endpoints = {}
+            for name, latencies in sorted(self._latencies.items()):
+                endpoints[name] = dict(count=len(latencies), errors=self._errors.get(name, 0),
+                                       throughput=len(latencies) / duration,
+                                       mean_bytes=self._bytes[name] / len(latencies),
+                                       p50=percentile(latencies, 0.5), p90=percentile(latencies, 0.9),
+                                       p99=percentile(latencies, 0.99), max=max(latencies))
+            everything = [latency for latencies in self._latencies.values() for latency in latencies]
+            total = dict(count=len(everything), errors=sum(self._errors.values()),
+                         throughput=len(everything) / duration,
+                         p50=percentile(everything, 0.5), p99=percentile(everything, 0.99))
+        return dict(endpoints=endpoints, total=total)
+
+class Client(object):
+    """A keep-alive connection to the server, like a browser tab keeps one.
+
+    Args:
+        port (int): The port of the server.
+        recorder (Recorder): Records the latency of every request, `None` to
+            not record them.
+        timeout (float): The socket timeout in seconds.
+    """
+
+    def __init__(self, port, recorder=None, timeout=10.0):
+        self._port = port
+        self._recorder = recorder
+        self._timeout = timeout
+        self._connection = None
+
+    def request(self, method, path, params=None, name=None):
+        """Send a request, returns the decoded JSON or text body, `None` if
+        the request failed."""
+        url = '/api' + path + ('?' + urlencode(params) if params else '')
+        started = time.perf_counter()
+        try:
+            if self._connection is None:
+                self._connection = http.client.HTTPConnection('127.0.0.1', self._port, timeout=self._timeout)
+            self._connection.request(method, url, headers={'Accept-Encoding': 'gzip'})
+            response = self._connection.getresponse()
+            body = response.read()
+            ok = 200 <= response.status < 300
+        except (OSError, http.client.HTTPException):
+            self.close()
+            body, ok = b'', False
+        elapsed = time.perf_counter() - started
+        if self._recorder is not None:
+            self._recorder.record(name or f'{method} /api{path}', elapsed, len(body), ok)
+        if not ok:
+            return None
+        if response.getheader('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        if response.getheader('Content-Type', '').startswith('application/json'):
+            return json.loads(body)
+        return body.decode()
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+def parse_metrics(text):
+    """Parse the Prometheus text format into a dict of (name, labels) to value."""
+    samples = {}
+    for line in text.splitlines():
+        result = METRIC_PATTERN.match(line)
+        if result is not None:
+            samples[(result.group(1), result.group(2) or '')] = float(result.group(3))
+    return samples
+
+def process_tree_rss(pid):
+    """Get the resident memory of a process and its children in bytes, `None` if it's gone."""
+    parents = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as file:
+                # the command may contain spaces, the fields after it don't
+                parents[int(entry)] = int(file.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+    tree = {pid}
+    added = True
+    while added:
+        children = {child for child, parent in parents.items() if parent in tree} - tree
+        tree |= children
+        added = bool(children)
+    total = None
+    for member in tree:
+        try:
+            with open(f'/proc/{member}/status') as file:
+                for line in file:
+                    if line.startswith('VmRSS:'):
+                        total = (total or 0) + int(line.split()[1]) * 1024
+        except OSError:
+            continue
+    return total
+
+def start_server(server, port, speed, directory, log):
+    environment = dict(os.environ, BREW_HARDWARE='simulated', BREW_SIMULATION_SPEED=str(speed))
+    if server == 'gunicorn':
+        command = ['gunicorn', '-c', os.path.join(SERVER_DIR, 'gunicorn.conf.py'), '--pythonpath', SERVER_DIR,
+                   '-b', f'127.0.0.1:{port}', 'app:app']
+    else:
+        # Flask's development server always listens on port 5000
+        command = [sys.executable, os.path.join(SERVER_DIR, 'app.py')]
+    return subprocess.Popen(command, cwd=directory, env=environment, stdout=log, stderr=subprocess.STDOUT)
+
+def wait_until(predicate, timeout, interval=0.5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(interval)
+    return False
+
+def poll(port, recorder, stop_event, interval):
+    # the UI asks for the chart samples since its last response and the messages after the last one it has
+    client = Client(port, recorder)
+    chart_cursor = None
+    message_cursor = None
+    # pollers start spread over the interval like independently opened tabs
+    stop_event.wait(random.random() * interval)
+    while not stop_event.is_set():
+        started = time.monotonic()
+        status = client.request('GET', '/status', None if chart_cursor is None else {'since': chart_cursor})
+        if status is not None:
+            chart_cursor = status['chartCursor']
+        client.request('GET', '/info')
+        messages = client.request('GET', '/messages', None if message_cursor is None else {'after': message_cursor})
+        if messages is not None:
+            message_cursor = messages['cursor']
+        stop_event.wait(interval - (time.monotonic() - started))
+    client.close()
+
+def burst(port, recorder, stop_event, interval, size):
+    client = Client(port, recorder)
+    pump = False
+    while not stop_event.wait(interval):
+        # a keypad edit sends several changes in a row
+        for _ in range(size):
+            client.request('PUT', '/setpoint', {'setpoint': round(random.uniform(40, 70), 1)})
+            pump = not pump
+            client.request('PUT', '/pump', {'pump': str(pump).lower()})
+    client.close()
+
+def subscribe(port, stop_event, counts, index):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1.0)
+    try:
+        connection.request('GET', '/api/stream')
+        response = connection.getresponse()
+        while not stop_event.is_set():
+            try:
+                line = response.readline()
+            except TimeoutError:
+                continue
+            if not line:
+                return
+            if line.startswith(b'event:'):
+                counts[index] += 1
+    except (OSError, http.client.HTTPException):
+        return
+    finally:
+        connection.close()
+
+def scrape(port, recorder, stop_event, interval, pid, samples):
+    client = Client(port, recorder)
+    while True:
+        text = client.request('GET', '/metrics')
+        rss = process_tree_rss(pid)
+        if text is not None:
+            samples.append(dict(time=time.monotonic(), rss=rss, metrics=parse_metrics(text)))
+        if stop_event.wait(interval):
+            break
+    client.close()
+
+def control_report(samples):
+    """Summarize the control loop metrics scraped over the run."""
+    first, last = samples[0]['metrics'], samples[-1]['metrics']
+
+    def value(metrics, name, labels=''):
+        return metrics.get((name, labels))
+
+    ticks = value(last, 'brew_tick_seconds_count') - value(first, 'brew_tick_seconds_count')
+    # each scrape has the quantiles of the latest ticks, the worst of them is the jitter under load
+    lateness_p99 = [value(sample['metrics'], 'brew_tick_lateness_seconds', 'quantile="0.99"') for sample in samples[1:]]
+    tick_p99 = [value(sample['metrics'], 'brew_tick_seconds', 'quantile="0.99"') for sample in samples[1:]]
+    return dict(ticks=ticks,
+                tick_p50=value(last, 'brew_tick_seconds', 'quantile="0.5"'),
+                tick_p99=max(tick_p99, default=None),
+                tick_max=value(last, 'brew_tick_seconds_max'),
+                lateness_p50=value(last, 'brew_tick_lateness_seconds', 'quantile="0.5"'),
+                lateness_p99=max(lateness_p99, default=None),
+                lateness_max=value(last, 'brew_tick_lateness_seconds_max'),
+                overruns=value(last, 'brew_tick_overruns_total') - value(first, 'brew_tick_overruns_total'),
+                missed_ticks=value(last, 'brew_missed_ticks_total') - value(first, 'brew_missed_ticks_total'))
+
+def rss_report(samples, speed):
+    values = [(sample['time'], sample['rss']) for sample in samples if sample['rss'] is not None]
+    if not values:
+        return None
+    (start_time, start), (end_time, end) = values[0], values[-1]
+    simulated_hours = (end_time - start_time) * speed / 3600
+    return dict(start=start, end=end, max=max(rss for _, rss in values),
+                growth_per_simulated_hour=(end - start) / simulated_hours if simulated_hours > 0 else None)
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SERVER_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def run(args):
+    port = 5000 if args.server == 'flask' else args.port
+    directory = tempfile.mkdtemp(prefix='brew-load-')
+    log = open(os.path.join(directory, 'server.log'), 'wb')
+    process = start_server(args.server, port, args.speed, directory, log)
+    probe = Client(port)
+    try:
+        if not wait_until(lambda: probe.request('GET', '/health') is not None, 30):
+            raise RuntimeError(f'the server did not start, see {log.name}')
+        history_full = False
+        if args.warmup:
+            print(f'waiting for {HISTORY_CAPACITY} chart samples, {HISTORY_CAPACITY / args.speed:.0f} s at speed {args.speed}', file=sys.stderr)
+            history_full = wait_until(lambda: (probe.request('GET', '/status', {'since': 0}) or {}).get('chartLength', 0) >= HISTORY_CAPACITY,
+                                      HISTORY_CAPACITY / args.speed * 2 + 30)
+
+        recorder = Recorder()
+        stop_event = threading.Event()
+        stream_counts = [0] * args.streams
+        samples = []
+        threads = [threading.Thread(target=poll, args=(port, recorder, stop_event, args.interval / args.speed)) for _ in range(args.pollers)]
+        threads += [threading.Thread(target=subscribe, args=(port, stop_event, stream_counts, index)) for index in range(args.streams)]
+        if args.burst_size > 0:
+            threads.append(threading.Thread(target=burst, args=(port, recorder, stop_event, args.burst_interval / args.speed, args.burst_size)))
+        threads.append(threading.Thread(target=scrape, args=(port, recorder, stop_event, args.scrape_interval, process.pid, samples)))
+        print(f'running {args.pollers} pollers and {args.streams} streams for {args.duration:.0f} s', file=sys.stderr)
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        stop_event.wait(args.duration)
+        stop_event.set()
+        for thread in threads:
+            thread.join()
+        duration = time.monotonic() - started
+
+        report = dict(benchmark='load', version=REPORT_VERSION, revision=git_revision(),
+                      started=datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                      config=dict(server=args.server, pollers=args.pollers, streams=args.streams, interval=args.interval,
+                                  burst_interval=args.burst_interval, burst_size=args.burst_size, speed=args.speed),
+                      duration=duration, simulated_hours=duration * args.speed / 3600, history_full=history_full)
+        report.update(recorder.report(duration))
+        report['control'] = control_report(samples) if len(samples) > 1 else None
+        report['rss'] = rss_report(samples, args.speed)
+        report['streams'] = dict(events=sum(stream_counts), events_per_second=sum(stream_counts) / duration)
+    finally:
+        probe.close()
+        process.send_signal(signal.SIGTERM)
+        try:
+            exit_code = process.wait(30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            exit_code = process.wait()
+        log.close()
+    report['server_exit_code'] = exit_code
+    if args.keep:
+        print(f'server files kept in {directory}', file=sys.stderr)
+    else:
+        shutil.rmtree(directory, ignore_errors=True)
+    return report
+
+def print_report(report):
+    print(f'{report["duration"]:.0f} s, {report["simulated_hours"]:.1f} simulated hours, revision {report["revision"]}')
+    print(f'{"endpoint":<24} {"count":>7} {"errors":>6} {"req/s":>7} {"p50 ms":>8} {"p99 ms":>8} {"max ms":>8} {"bytes":>7}')
+    for name, endpoint in report['endpoints'].items():
+        print(f'{name:<24} {endpoint["count"]:7d} {endpoint["errors"]:6d} {endpoint["throughput"]:7.1f} '
+              f'{endpoint["p50"] * 1000:8.2f} {endpoint["p99"] * 1000:8.2f} {endpoint["max"] * 1000:8.2f} {endpoint["mean_bytes"]:7.0f}')
+    control = report['control']
+    if control is not None:
+        print(f'control: {control["ticks"]:.0f} ticks, tick p99 {control["tick_p99"] * 1000:.2f} ms, '
+              f'lateness p99 {control["lateness_p99"] * 1000:.2f} ms, max {control["lateness_max"] * 1000:.2f} ms, '
+              f'{control["overruns"]:.0f} overruns, {control["missed_ticks"]:.0f} missed')
+    rss = report['rss']
+    if rss is not None:
+        print(f'rss: {rss["start"] / 2 ** 20:.1f} MiB at the start, {rss["max"] / 2 ** 20:.1f} MiB max, {rss["end"] / 2 ** 20:.1f} MiB at the end')
+    print(f'streams: {report["streams"]["events"]} events')
+
+def _leaves(value, path=()):
+    if isinstance(value, dict):
+        for key, child in value.items():
+            yield from _leaves(child, path + (key,))
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield path, value
+
+def compare(old, new, threshold):
+    """Print the changes between two reports, returns the number of regressions.
+
+    Latencies, lateness, memory, errors and dropped ticks regress when they
+    grow, throughput when it shrinks. Counts which follow from the duration
+    aren't compared.
+    """
+    lower_is_better = {'p50', 'p90', 'p99', 'max', 'mean_bytes', 'tick_p50', 'tick_p99', 'tick_max', 'lateness_p50',
+                       'lateness_p99', 'lateness_max', 'errors', 'overruns', 'missed_ticks', 'growth_per_simulated_hour'}
+    higher_is_better = {'throughput'}
+    old_values = {path: value for path, value in _leaves(old) if path[0] in ('endpoints', 'total', 'control', 'rss')}
+    regressions = 0
+    for path, value in _leaves(new):
+        name = path[-1]
+        if path not in old_values or name not in lower_is_better | higher_is_better:
+            continue
+        previous = old_values[path]
+        change = (value - previous) / abs(previous) if previous else (0.0 if value == previous else float('inf'))
+        worse = change > threshold if name in lower_is_better else change < -threshold
+        regressions += worse
+        print(f'{"REGRESSION " if worse else "           "}{".".join(path):<48} {previous:14.6g} {value:14.6g} {change:+8.1%}')
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Load and soak benchmark of the HTTP API against the simulated controller.')
+    parser.add_argument('--server', choices=['gunicorn', 'flask'], default='gunicorn')
+    parser.add_argument('--port', type=int, default=5077, help='the port gunicorn listens on')
+    parser.add_argument('--pollers', type=int, default=4, help='clients polling like a UI')
+    parser.add_argument('--streams', type=int, default=4, help='event stream subscribers')
+    parser.add_argument('--interval', type=float, default=1.0, help='simulated seconds between the polls of a client')
+    parser.add_argument('--burst-interval', type=float, default=10.0, help='simulated seconds between bursts of changes')
+    parser.add_argument('--burst-size', type=int, default=5, help='setpoint and pump changes per burst, 0 for none')
+    parser.add_argument('--scrape-interval', type=float, default=5.0, help='seconds between metrics scrapes')
+    parser.add_argument('--duration', type=float, default=120.0, help='seconds of load after the warmup')
+    parser.add_argument('--speed', type=float, default=20.0, help='simulated seconds per real second')
+    parser.add_argument('--no-warmup', dest='warmup', action='store_false', help="don't wait for a full chart history")
+    parser.add_argument('--keep', action='store_true', help='keep the server log and files')
+    parser.add_argument('--output', help='write the report as JSON to this file')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two reports instead of running')
+    parser.add_argument('--threshold', type=float, default=0.2, help='relative change counted as a regression')
+    args = parser.parse_args()
+
+    if args.compare is not None:
+        with open(args.compare[0]) as file:
+            old = json.load(file)
+        with open(args.compare[1]) as file:
+            new = json.load(file)
+        regressions = compare(old, new, args.threshold)
+        print(f'{regressions} regressions')
+        sys.exit(1 if regressions else 0)
+
+    report = run(args)
+    print_report(report)
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+if __name__ == '__main__':
+    main()
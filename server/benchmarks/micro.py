@@ -0,0 +1,295 @@
+"""Micro-benchmarks of the code which runs on every control tick and status request.
+
+Covers `PID.calc()`, `PIDAutotune.run()` over a long oscillating trace at
+several lookback windows, appending to a chart history at full capacity like
+`save_chart_data()` does and building and encoding a full `/api/status`
+payload with the functions the app builds it with. Time is
+injected through the `time=` parameters and every input comes from a seeded
+trace, so runs are repeatable.
+
+Each benchmark reports the time per operation (the fastest and the median of
+several repeats, with the garbage collector off and the cost of an empty call
+taken off) and the memory per operation from tracemalloc: the peak of what one
+operation allocates and what it keeps allocated afterwards. Reports of two
+revisions can be compared, regressions beyond a threshold make the comparison
+fail.
+
+Usage:
+    python3 benchmarks/micro.py --output micro.json
+    python3 benchmarks/micro.py --filter autotune --repeat 9
+    python3 benchmarks/micro.py --compare baseline.json micro.json
+"""
+import argparse
+import gc
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+
+from autotune import PIDAutotune
+from pid import PID
+from status import build_status, finish_status
+from zone import Zone
+
+REPORT_VERSION = 1
+SETPOINT = 65.0
+# samples of the synthetic traces, longer than the chart history and many autotune cycles
+TRACE_LENGTH = 100000
+# bytes per operation retained memory may grow by before it counts as a leak
+LEAK_SLACK = 100
+
+class SteppingClock(object):
+    """A time source which moves ahead by a fixed step every time it's read.
+
+    Args:
+        step (float): The seconds between two reads.
+    """
+
+    def __init__(self, step):
+        self._step = step
+        self._now = 0.0
+
+    def __call__(self):
+        self._now += self._step
+        return self._now
+
+def oscillation_trace(period, amplitude, noise, seed=0):
+    """A temperature oscillating around the setpoint with Gaussian noise, one sample per second."""
+    generator = random.Random(seed)
+    return [SETPOINT + amplitude * math.sin(2 * math.pi * index / period) + generator.gauss(0.0, noise)
+            for index in range(TRACE_LENGTH)]
+
+def trace_inputs(trace):
+    """Get a function returning the samples of a trace one by one, starting
+    over at the end. Nothing is allocated per sample, so the inputs don't
+    show up in the memory of an operation."""
+    index = -1
+    length = len(trace)
+
+    def next_input():
+        nonlocal index
+        index = (index + 1) % length
+        return trace[index]
+    return next_input
+
+def pid_calc():
+    pid = PID(1, 30.0, 0.05, 200.0, time=SteppingClock(1.0))
+    inputs = trace_inputs(oscillation_trace(600, 0.5, 0.03))
+    return lambda: pid.calc(inputs(), SETPOINT)
+
+def pid_calc_dt():
+    # the control loop passes the time since the previous tick
+    pid = PID(1, 30.0, 0.05, 200.0, time=SteppingClock(1.0))
+    inputs = trace_inputs(oscillation_trace(600, 0.5, 0.03))
+    return lambda: pid.calc(inputs(), SETPOINT, 1.0)
+
+def autotune_run(lookback):
+    def setup():
+        # a kettle oscillating under the relay, the tuner starts over whenever it finishes
+        tuner = PIDAutotune(1, SETPOINT, out_step=50, lookback=lookback, noiseband=0.2, time=SteppingClock(1.0))
+        inputs = trace_inputs(oscillation_trace(4 * lookback, 1.5, 0.05))
+        return lambda: tuner.run(inputs())
+    return setup
+
+def full_zone():
+    """A zone with a chart history at capacity and a running PID."""
+    zone = Zone('benchmark', '28-000000000000', None)
+    zone.mode = 'auto'
+    zone.has_temperature_sensor_error = False
+    zone.setpoint = SETPOINT
+    zone.pid = PID(1, 30.0, 0.05, 200.0, time=SteppingClock(1.0))
+    timestamp = 1700000000000
+    for temperature in oscillation_trace(600, 0.5, 0.03)[:zone.chart_history.capacity]:
+        zone.temperature = temperature
+        zone.duty_cycle = zone.pid.calc(temperature, SETPOINT)
+        state = zone.pid.state
+        zone.chart_history.append(timestamp, temperature, SETPOINT, zone.duty_cycle, state.p, state.i, state.d,
+                                  temperature, temperature)
+        timestamp += 1000
+    return zone
+
+def history_append():
+    zone = full_zone()
+    chart_history = zone.chart_history
+    state = zone.pid.state
+    timestamps = iter(range(1800000000000, 1800000000000 + 1000 * 10 ** 9, 1000)).__next__
+
+    # the arguments save_chart_data() passes, which evicts the oldest sample at capacity
+    def append():
+        chart_history.append(timestamps(), None if zone.has_temperature_sensor_error else zone.temperature,
+                             None if state is None else zone.setpoint, zone.duty_cycle,
+                             None if state is None else state.p, None if state is None else state.i,
+                             None if state is None else state.d, zone.estimated_temperature,
+                             None if state is None else zone.control_temperature)
+    return append
+
+def status_build():
+    # the full chart of a client opening the UI, built under the lock and finished after releasing it
+    zone = full_zone()
+    return lambda: finish_status(build_status(zone, False, 12))
+
+def status_json_dumps():
+    payload = finish_status(build_status(full_zone(), False, 12))
+    return lambda: json.dumps(payload).encode()
+
+def status_json_dumps_incremental():
+    # a client following along only gets the sample appended since its last poll
+    zone = full_zone()
+    payload = finish_status(build_status(zone, False, 12, zone.chart_history.cursor - 1))
+    return lambda: json.dumps(payload).encode()
+
+def empty():
+    return lambda: None
+
+# name, setup returning the operation, operations per repeat
+BENCHMARKS = [
+    ('pid.calc', pid_calc, 200000),
+    ('pid.calc(dt)', pid_calc_dt, 200000),
+    ('autotune.run lookback=30', autotune_run(30), 100000),
+    ('autotune.run lookback=60', autotune_run(60), 100000),
+    ('autotune.run lookback=240', autotune_run(240), 100000),
+    ('autotune.run lookback=600', autotune_run(600), 100000),
+    ('history.append full', history_append, 100000),
+    ('status.build full', status_build, 200),
+    ('status.json_dumps full', status_json_dumps, 200),
+    ('status.json_dumps incremental', status_json_dumps_incremental, 50000),
+]
+
+def time_operation(operation, count, repeat):
+    """Get the nanoseconds per operation of every repeat."""
+    results = []
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            started = time.perf_counter_ns()
+            for _ in range(count):
+                operation()
+            results.append((time.perf_counter_ns() - started) / count)
+    finally:
+        if enabled:
+            gc.enable()
+    return results
+
+def measure_memory(operation, count):
+    """Get the mean peak and retained bytes of an operation."""
+    tracemalloc.start()
+    try:
+        # the first operation traced keeps a few kB which later ones reuse, it would show up as a leak of small counts
+        operation()
+        peaks = 0
+        start, _ = tracemalloc.get_traced_memory()
+        for _ in range(count):
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            operation()
+            _, peak = tracemalloc.get_traced_memory()
+            peaks += peak - before
+        end, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peaks / count, (end - start) / count
+
+def run_benchmark(setup, count, repeat, scale, overhead):
+    operation = setup()
+    count = max(1, int(count * scale))
+    # warm up caches and let the deques and histories reach their steady size
+    time_operation(operation, min(count, 10000), 1)
+    timings = time_operation(operation, count, repeat)
+    # enough operations that what a few of them keep for reuse doesn't look like a leak, whatever the scale
+    peak, retained = measure_memory(operation, 1000 if count >= 1000 else 100)
+    return dict(ops=count, repeat=repeat,
+                ns_per_op=max(0.0, min(timings) - overhead['ns_per_op']),
+                median_ns_per_op=max(0.0, statistics.median(timings) - overhead['ns_per_op']),
+                peak_bytes_per_op=max(0.0, peak - overhead['peak_bytes_per_op']),
+                retained_bytes_per_op=max(0.0, retained - overhead['retained_bytes_per_op']))
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SERVER_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def run(args):
+    operation = empty()
+    timings = time_operation(operation, int(1000000 * args.scale) or 1, args.repeat)
+    peak, retained = measure_memory(operation, 1000)
+    # the cost of calling an operation and reading the clocks, taken off every result
+    overhead = dict(ns_per_op=min(timings), peak_bytes_per_op=peak, retained_bytes_per_op=retained)
+    results = {}
+    for name, setup, count in BENCHMARKS:
+        if args.filter is not None and args.filter not in name:
+            continue
+        results[name] = run_benchmark(setup, count, args.repeat, args.scale, overhead)
+        result = results[name]
+        print(f'{name:<32} {result["ns_per_op"]:12.0f} {result["median_ns_per_op"]:12.0f} '
+              f'{result["peak_bytes_per_op"]:10.0f} {result["retained_bytes_per_op"]:10.1f}', flush=True)
+    return dict(benchmark='micro', version=REPORT_VERSION, revision=git_revision(),
+                started=datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                python=platform.python_version(), implementation=platform.python_implementation(),
+                machine=platform.machine(), overhead=overhead, results=results)
+
+def compare(old, new, threshold):
+    """Print the changes between two reports, returns the number of regressions.
+
+    The fastest time and the peak memory of an operation regress when they
+    grow by more than `threshold`. Retained memory regresses when it grows
+    by more than `LEAK_SLACK` bytes per operation, that is a leak; smaller
+    changes come from deques and free lists growing in blocks.
+    """
+    regressions = 0
+    print(f'{"":11}{"benchmark":<32} {"old ns/op":>10} {"new ns/op":>10} {"change":>8} {"old peak":>9} {"new peak":>9} {"kept":>6}')
+    for name, result in new['results'].items():
+        previous = old['results'].get(name)
+        if previous is None:
+            continue
+        change = result['ns_per_op'] / previous['ns_per_op'] - 1 if previous['ns_per_op'] else 0.0
+        worse = (change > threshold
+                 or result['peak_bytes_per_op'] > previous['peak_bytes_per_op'] * (1 + threshold) + 16
+                 or result['retained_bytes_per_op'] > previous['retained_bytes_per_op'] + LEAK_SLACK)
+        regressions += worse
+        print(f'{"REGRESSION " if worse else "           "}{name:<32} {previous["ns_per_op"]:10.0f} {result["ns_per_op"]:10.0f} '
+              f'{change:+8.1%} {previous["peak_bytes_per_op"]:9.0f} {result["peak_bytes_per_op"]:9.0f} '
+              f'{result["retained_bytes_per_op"]:6.1f}')
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmarks of the control loop and status hot paths.')
+    parser.add_argument('--repeat', type=int, default=5, help='timed repeats of every benchmark')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiplies the operations per repeat')
+    parser.add_argument('--filter', help='only run benchmarks whose name contains this')
+    parser.add_argument('--output', help='write the report as JSON to this file')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two reports instead of running')
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative change counted as a regression')
+    args = parser.parse_args()
+
+    if args.compare is not None:
+        with open(args.compare[0]) as file:
+            old = json.load(file)
+        with open(args.compare[1]) as file:
+            new = json.load(file)
+        if (old.get('python'), old.get('machine')) != (new.get('python'), new.get('machine')):
+            print('the reports come from different Python versions or machines, times are not comparable', file=sys.stderr)
+        regressions = compare(old, new, args.threshold)
+        print(f'{regressions} regressions')
+        sys.exit(1 if regressions else 0)
+
+    print(f'{"benchmark":<32} {"ns/op":>12} {"median":>12} {"peak B":>10} {"kept B":>10}')
+    report = run(args)
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+if __name__ == '__main__':
+    main()
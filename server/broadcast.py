@@ -0,0 +1,85 @@
+import json
+import queue
+import threading
+import logging
+
+class Broadcaster(object):
+    """Fans out Server-Sent Events to any number of subscribers.
+
+    Every event is encoded once when it's published and the same frame is
+    queued for each subscriber. Subscribers which fall too far behind are
+    dropped instead of slowing down the publisher.
+
+    Args:
+        max_queued (int): How many frames a subscriber can fall behind before
+            it's dropped.
+        keepalive (float): How often a comment is sent to idle subscribers in
+            seconds.
+    """
+
+    class Subscriber(object):
+        def __init__(self, max_queued):
+            self.frames = queue.Queue(maxsize=max_queued)
+            self.closed = False
+
+    def __init__(self, max_queued=30, keepalive=15.0):
+        self._logger = logging.getLogger(type(self).__name__)
+        self._max_queued = max_queued
+        self._keepalive = keepalive
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    @staticmethod
+    def encode(event, data):
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+
+    def publish(self, event, data):
+        if not self._subscribers:
+            return
+        self.publish_frame(Broadcaster.encode(event, data))
+
+    def publish_frame(self, frame):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.frames.put_nowait(frame)
+            except queue.Full:
+                self._logger.warning('dropping slow event stream subscriber')
+                self._unsubscribe(subscriber)
+
+    def close(self):
+        """Drop all subscribers, which ends their streams."""
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            self._unsubscribe(subscriber)
+            try:
+                # wakes up a stream waiting for a frame
+                subscriber.frames.put_nowait(b"")
+            except queue.Full:
+                pass
+
+    def stream(self):
+        """Subscribe and yield frames until the subscriber is dropped."""
+        subscriber = Broadcaster.Subscriber(self._max_queued)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        try:
+            yield b"retry: 1000\n\n"
+            while not subscriber.closed:
+                try:
+                    yield subscriber.frames.get(timeout=self._keepalive)
+                except queue.Empty:
+                    yield b": keepalive\n\n"
+        finally:
+            self._unsubscribe(subscriber)
+
+    def _unsubscribe(self, subscriber):
+        subscriber.closed = True
+        with self._lock:
+            self._subscribers.discard(subscriber)
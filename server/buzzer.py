@@ -0,0 +1,69 @@
+import queue
+import threading
+import logging
+
+class Buzzer(object):
+    """Plays buzzer patterns in a background thread.
+
+    A pattern is a sequence of durations in seconds, alternating between the
+    buzzer being on and off, starting with on.
+
+    Args:
+        output (function): A function which turns the buzzer on or off when
+            called with `True` or `False`.
+        max_queued (int): How many patterns can wait to be played before new
+            ones are dropped.
+    """
+    BEEP = (0.5,)
+    DOUBLE_BEEP = (0.2, 0.2, 0.2)
+    REPEATED_BEEP = (0.3, 0.3, 0.3, 0.3, 0.3, 0.3, 0.3)
+    LONG_TONE = (2.0,)
+
+    def __init__(self, output, max_queued=10):
+        self._logger = logging.getLogger(type(self).__name__)
+        self._output = output
+        self._patterns = queue.Queue(maxsize=max_queued)
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='buzzer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        try:
+            self._patterns.put_nowait(())
+        except queue.Full:
+            pass
+        self._thread.join()
+        self._thread = None
+        self._output(False)
+
+    def play(self, pattern=BEEP):
+        """Queue a pattern, returns immediately.
+
+        Returns:
+            `true` if the pattern was queued, `false` if the queue was full.
+        """
+        try:
+            self._patterns.put_nowait(tuple(pattern))
+            return True
+        except queue.Full:
+            self._logger.warning('buzzer queue full, dropping pattern')
+            return False
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            pattern = self._patterns.get()
+            for index, duration in enumerate(pattern):
+                if self._stop_event.is_set():
+                    break
+                self._output(index % 2 == 0)
+                self._stop_event.wait(duration)
+            self._output(False)
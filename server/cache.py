@@ -0,0 +1,30 @@
+from clock import Clock
+
+class TtlCache(object):
+    """Caches the result of a function for a fixed time.
+
+    Args:
+        function (function): Computes the value.
+        ttl (float): How long a value is reused in seconds.
+        clock (Clock): The clock to measure the age of the value with.
+    """
+
+    def __init__(self, function, ttl, clock=Clock()):
+        if ttl < 0:
+            raise ValueError('ttl must be greater or equal to 0')
+
+        self._function = function
+        self._ttl = ttl
+        self._clock = clock
+        self._value = None
+        self._expires_at = None
+
+    def get(self):
+        now = self._clock.monotonic()
+        if self._expires_at is None or now >= self._expires_at:
+            self._value = self._function()
+            self._expires_at = now + self._ttl
+        return self._value
+
+    def invalidate(self):
+        self._expires_at = None
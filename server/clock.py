@@ -0,0 +1,73 @@
+import time
+import threading
+
+class Clock(object):
+    """Wall clock and monotonic time in seconds, with waiting."""
+
+    speed = 1.0
+
+    def time(self):
+        return time.time()
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def wait(self, event, seconds):
+        """Wait on an event for clock seconds, returns `true` if it was set."""
+        return event.wait(max(0.0, seconds))
+
+class ScaledClock(Clock):
+    """A clock running `speed` times faster than real time.
+
+    Args:
+        speed (float): How many clock seconds pass per real second.
+        start (float): The wall clock time to start from.
+    """
+
+    def __init__(self, speed=1.0, start=None):
+        if speed <= 0:
+            raise ValueError('speed must be greater than 0')
+
+        self.speed = speed
+        self._real_start = time.monotonic()
+        self._start = time.time() if start is None else start
+
+    def time(self):
+        return self._start + self.monotonic()
+
+    def monotonic(self):
+        return (time.monotonic() - self._real_start) * self.speed
+
+    def wait(self, event, seconds):
+        return event.wait(max(0.0, seconds) / self.speed)
+
+class ManualClock(Clock):
+    """A clock which only moves when advanced, for running simulations as
+    fast as possible.
+
+    Args:
+        start (float): The wall clock time to start from.
+    """
+
+    speed = float('inf')
+
+    def __init__(self, start=0.0):
+        self._start = start
+        self._now = 0.0
+        self._lock = threading.Lock()
+
+    def time(self):
+        return self._start + self._now
+
+    def monotonic(self):
+        return self._now
+
+    def advance(self, seconds):
+        with self._lock:
+            self._now += seconds
+
+    def wait(self, event, seconds):
+        if event.is_set():
+            return True
+        self.advance(max(0.0, seconds))
+        return event.is_set()
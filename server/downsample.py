@@ -0,0 +1,130 @@
+import math
+import threading
+from itertools import chain, islice
+
+class MinMaxDownsampler(object):
+    """Reduces the samples of a History to a minimum and a maximum per bucket.
+
+    Every field except the x axis keeps its extremes in the order they
+    occurred, so peaks survive the reduction. The x axis gets the first and
+    last value of the bucket.
+
+    Buckets are aligned to the history cursor, so a bucket never changes once
+    it is complete. Complete buckets are cached between calls and only samples
+    appended since the previous call are aggregated, the partially filled (or
+    partially evicted) buckets at both ends are recomputed every time.
+
+    `reduce()` works on a copy of the history, so the samples only need to be
+    consistent while they are copied and the aggregation can run without the
+    lock which guards the history.
+
+    Args:
+        history (History): The samples to reduce.
+        bucket_size (int): The number of samples per bucket.
+        x (str): The field used as the x axis.
+    """
+
+    def __init__(self, history, bucket_size, x='timestamp'):
+        if bucket_size < 1:
+            raise ValueError('bucket_size must be greater or equal to 1')
+        if x not in history.fields:
+            raise ValueError('x must be a history field')
+
+        self._history = history
+        self._bucket_size = bucket_size
+        self._x = x
+        self._buckets = []
+        self._next_cursor = None
+        self._lock = threading.Lock()
+
+    @property
+    def bucket_size(self):
+        return self._bucket_size
+
+    def reduce(self, history):
+        """Update with a copy of the history and get the reduced samples, safe
+        to call from several threads.
+
+        Args:
+            history (History): A copy of the history, see `History.copy()`.
+        """
+        with self._lock:
+            self.update(history)
+            return self.output(history)
+
+    def update(self, history=None):
+        """Aggregate the complete buckets appended since the previous call.
+
+        Args:
+            history (History): A copy of the history to read the samples
+                from, the history itself if not specified.
+        """
+        history = self._history if history is None else history
+        size = self._bucket_size
+        first_bucket_start = -(-history.first_cursor // size) * size
+        if not history.is_continuous(self._next_cursor) or self._next_cursor < first_bucket_start:
+            self._buckets = []
+            self._next_cursor = first_bucket_start
+
+        evicted = 0
+        while evicted < len(self._buckets) and self._buckets[evicted][0] < first_bucket_start:
+            evicted += 1
+        if evicted > 0:
+            del self._buckets[:evicted]
+
+        complete_end = history.cursor // size * size
+        while self._next_cursor + size <= complete_end:
+            self._buckets.append(self._aggregate(history, self._next_cursor, self._next_cursor + size))
+            self._next_cursor += size
+
+    def output(self, history=None):
+        """Get the reduced samples.
+
+        Args:
+            history (History): The copy of the history the last update read,
+                the history itself if not specified.
+
+        Returns:
+            A dict of field name to list of values, NaN values are returned as
+            `None`.
+        """
+        history = self._history if history is None else history
+        buckets = []
+        head_end = min(-(-history.first_cursor // self._bucket_size) * self._bucket_size, history.cursor)
+        if history.first_cursor < head_end:
+            buckets.append(self._aggregate(history, history.first_cursor, head_end))
+        buckets.extend(self._buckets)
+        if self._next_cursor is not None and self._next_cursor < history.cursor:
+            buckets.append(self._aggregate(history, max(self._next_cursor, history.first_cursor), history.cursor))
+
+        result = {name: [] for name in history.fields}
+        for _, values in buckets:
+            single = values[self._x][0] == values[self._x][1]
+            for name, pair in values.items():
+                for value in pair[:1] if single else pair:
+                    result[name].append(None if value != value else value)
+        return result
+
+    def _aggregate(self, history, start, end):
+        count = history.cursor - start
+        values = {}
+        for name in history.fields:
+            samples = list(islice(chain.from_iterable(history.views(name, count)), end - start))
+            if name == self._x:
+                values[name] = (samples[0], samples[-1])
+                continue
+            min_index = max_index = None
+            for index, value in enumerate(samples):
+                if value != value:
+                    continue
+                if min_index is None or value < samples[min_index]:
+                    min_index = index
+                if max_index is None or value > samples[max_index]:
+                    max_index = index
+            if min_index is None:
+                values[name] = (math.nan, math.nan)
+            elif min_index <= max_index:
+                values[name] = (samples[min_index], samples[max_index])
+            else:
+                values[name] = (samples[max_index], samples[min_index])
+        return start, values
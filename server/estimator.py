@@ -0,0 +1,158 @@
+import math
+from collections import deque
+
+class KalmanEstimator(object):
+    """Estimates the temperature and its rate of change from noisy, quantized
+    probe readings.
+
+    A Kalman filter tracks the temperature and a rate of change which drifts
+    like a random walk. The variance of every reading is the probe noise plus
+    the quantization of its resolution, so coarse readings are trusted less.
+    The estimate can be projected ahead to make up for the age of the reading
+    and the lag of the probe.
+
+    Args:
+        process_noise (float): How fast the rate of change drifts, in
+            (°C/s)² per second.
+        measurement_noise (float): The variance of the probe noise in °C².
+        lead_time (float): How far the estimate is projected ahead of the
+            reading on top of its age, the time constant of the probe, in
+            seconds.
+    """
+
+    def __init__(self, process_noise=1e-5, measurement_noise=4e-4, lead_time=0.0):
+        if process_noise <= 0:
+            raise ValueError('process_noise must be greater than 0')
+        if measurement_noise < 0:
+            raise ValueError('measurement_noise must be greater or equal to 0')
+        if lead_time < 0:
+            raise ValueError('lead_time must be greater or equal to 0')
+
+        self._process_noise = process_noise
+        self._measurement_noise = measurement_noise
+        self._lead_time = lead_time
+        self.reset()
+
+    @property
+    def is_initialized(self):
+        return self._temperature is not None
+
+    @property
+    def rate(self):
+        """The rate of change in °C/s, `None` before the first reading."""
+        return self._rate
+
+    def reset(self):
+        self._temperature = None
+        self._rate = None
+        self._p00 = self._p01 = self._p11 = 0.0
+
+    def update(self, measurement, dt, step=0.0625):
+        """Correct the estimate with a reading.
+
+        Args:
+            measurement (float): The reading in °C.
+            dt (float): The time since the previous reading in seconds.
+            step (float): The resolution of the reading in °C.
+        """
+        variance = self._measurement_noise + step * step / 12
+        if self._temperature is None:
+            self._temperature = measurement
+            self._rate = 0.0
+            # the rate is unknown, a heater at full power moves a kettle by a few hundredths of a degree per second
+            self._p00, self._p01, self._p11 = variance, 0.0, 1e-3
+            return
+
+        # predict with a constant rate
+        q = self._process_noise
+        p00, p01, p11 = self._p00, self._p01, self._p11
+        self._temperature += self._rate * dt
+        p00 += dt * (2 * p01 + dt * p11) + q * dt ** 3 / 3
+        p01 += dt * p11 + q * dt ** 2 / 2
+        p11 += q * dt
+
+        # correct with the reading
+        innovation = measurement - self._temperature
+        s = p00 + variance
+        k0 = p00 / s
+        k1 = p01 / s
+        self._temperature += k0 * innovation
+        self._rate += k1 * innovation
+        self._p00 = (1 - k0) * p00
+        self._p01 = (1 - k0) * p01
+        self._p11 = p11 - k1 * p01
+
+    def temperature(self, age=0.0):
+        """Get the estimated temperature, `None` before the first reading.
+
+        Args:
+            age (float): How long ago the latest reading was taken in seconds.
+        """
+        if self._temperature is None:
+            return None
+        return self._temperature + self._rate * (age + self._lead_time)
+
+class SmithPredictor(object):
+    """Takes the dead time out of the loop as the controller sees it.
+
+    A first order model of the process is driven with the heater duty cycle
+    and its output is kept for a dead time. Adding the difference between
+    the model output now and a dead time ago to the measured temperature
+    gives the controller the temperature the process is heading to, so it
+    reacts as if the process had no dead time and aggressive gains overshoot
+    less.
+
+    The model starts at rest while the kettle may not be. With the time
+    constant of a kettle, which is hours, that difference would bias the
+    temperature the controller sees for hours, so the model time constant is
+    limited to `MAX_TIME_CONSTANT_RATIO` dead times. The bias fades within
+    a few of those, while the change over the next dead time is still
+    predicted within 2%.
+
+    Args:
+        slope (float): The initial rate of change per % duty cycle in °C/s.
+        time_constant (float): The time constant of the process in seconds,
+            `math.inf` for a process which integrates.
+        dead_time (float): The dead time of the process in seconds.
+    """
+    MAX_TIME_CONSTANT_RATIO = 30
+
+    def __init__(self, slope, time_constant, dead_time):
+        if slope <= 0:
+            raise ValueError('slope must be greater than 0')
+        if time_constant <= 0:
+            raise ValueError('time_constant must be greater than 0')
+        if dead_time < 0:
+            raise ValueError('dead_time must be greater or equal to 0')
+
+        self._slope = slope
+        self._time_constant = min(time_constant, SmithPredictor.MAX_TIME_CONSTANT_RATIO * max(dead_time, 1.0))
+        self._dead_time = dead_time
+        self._time = 0.0
+        self._output = 0.0
+        # model outputs which haven't reached the end of the dead time yet as (time, output), the first one has
+        self._history = deque([(0.0, 0.0)])
+
+    @property
+    def correction(self):
+        """How far the temperature will move once the probe shows the duty
+        cycles of the last dead time in °C."""
+        return self._output - self._history[0][1]
+
+    def update(self, duty_cycle, dt):
+        """Advance the model by the time a duty cycle was applied for.
+
+        Args:
+            duty_cycle (float): The duty cycle applied in %.
+            dt (float): How long it was applied in seconds.
+        """
+        if dt <= 0:
+            return
+        # exact for a duty cycle which is constant over dt
+        decay = math.exp(-dt / self._time_constant)
+        self._output = self._output * decay + self._slope * self._time_constant * duty_cycle * (1 - decay)
+        self._time += dt
+        self._history.append((self._time, self._output))
+        delayed_time = self._time - self._dead_time
+        while len(self._history) > 1 and self._history[1][0] <= delayed_time:
+            self._history.popleft()
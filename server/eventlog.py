@@ -0,0 +1,71 @@
+import threading
+
+class EventLog(object):
+    """An append-only log of events numbered by a sequence, keeping the
+    latest `capacity` events.
+
+    Readers pass the sequence of the last event they have and get the events
+    after it, so every client sees every event once no matter how many read
+    along. Events are kept in a ring, appending overwrites the oldest slot
+    and reading copies only the requested events. Appends are serialized,
+    reads never wait: a slot is filled before the sequence which makes it
+    visible is published.
+
+    Args:
+        capacity (int): How many events are kept.
+    """
+
+    def __init__(self, capacity):
+        if capacity < 1:
+            raise ValueError('capacity must be greater or equal to 1')
+
+        self._capacity = capacity
+        self._slots = [None] * capacity
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    @property
+    def sequence(self):
+        """The sequence of the latest event, 0 before the first one."""
+        return self._sequence
+
+    def append(self, event):
+        """Append an event, a dict which gets its sequence as `sequence` and
+        must not be modified afterwards.
+
+        Returns:
+            The event.
+        """
+        with self._lock:
+            sequence = self._sequence + 1
+            event["sequence"] = sequence
+            self._slots[sequence % self._capacity] = event
+            self._sequence = sequence
+        return event
+
+    def since(self, sequence=0):
+        """Get the events after a sequence.
+
+        Args:
+            sequence (int): The sequence of the last event the reader has, 0
+                for all events.
+
+        Returns:
+            A tuple of the events oldest first, the sequence to pass next
+            time and whether events after `sequence` were already evicted.
+        """
+        latest = self._sequence
+        # a reader ahead of the log has seen a previous run of the server, it starts over
+        if sequence < 0 or sequence > latest:
+            sequence = 0
+        first = max(sequence + 1, latest - self._capacity + 1)
+        missed = first > sequence + 1
+        events = []
+        for expected in range(first, latest + 1):
+            event = self._slots[expected % self._capacity]
+            # overwritten by appends while reading
+            if event is None or event["sequence"] != expected:
+                missed = True
+                continue
+            events.append(event)
+        return events, latest, missed
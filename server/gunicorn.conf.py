@@ -0,0 +1,35 @@
+# gunicorn -c gunicorn.conf.py app:app
+import signal
+
+bind = "0.0.0.0:5000"
+
+# the controller owns the sensors and GPIO pins, so the app runs in exactly one process and requests are
+# served by its thread pool
+workers = 1
+worker_class = "gthread"
+# every open event stream holds a thread, the rest serve polling UIs and the metrics scraper
+threads = 16
+
+# idle keep-alive connections wait in the worker's poller without holding a thread
+keepalive = 30
+graceful_timeout = 10
+
+accesslog = None
+errorlog = "-"
+
+def post_worker_init(worker):
+    # event streams never finish on their own, they are ended as soon as the worker is told to stop, otherwise it
+    # waits for them until the graceful timeout and gets killed before shutting the controller down
+    handle_exit = worker.handle_exit
+
+    def end_streams_and_exit(sig, frame):
+        import app
+        app.broadcaster.close()
+        handle_exit(sig, frame)
+
+    signal.signal(signal.SIGTERM, end_streams_and_exit)
+
+def worker_exit(server, worker):
+    # runs in the worker before the interpreter exit waits for request threads, which event streams would block
+    import app
+    app.shutdown()
@@ -0,0 +1,157 @@
+import threading
+from sensor import W1Bus, CONVERSION_TIMES, DEFAULT_RESOLUTION, RESOLUTION_STEPS
+
+class RaspberryPiHardware(object):
+    """The heaters, fan, pump, buzzer and temperature sensors wired to the
+    Raspberry Pi, see the GPIO pins section of the README.
+
+    The first heater uses the hardware PWM channel, further heaters are
+    driven with software PWM on a GPIO pin, which is fine for switching
+    solid state relays.
+    """
+    PUMP_PIN = 13
+    FAN_TACH_PIN = 37
+    BUZZER_PIN = 18
+    ONE_WIRE_PIN = 7
+    FAN_PWM_PIN = 32
+    HEATER_PWM_PIN = 33
+    # board pins which are wired to something else and can't drive a software PWM heater
+    RESERVED_PINS = frozenset([PUMP_PIN, FAN_TACH_PIN, BUZZER_PIN, ONE_WIRE_PIN, FAN_PWM_PIN, HEATER_PWM_PIN])
+    SOFTWARE_PWM_FREQUENCY = 50
+
+    def __init__(self):
+        import RPi.GPIO as GPIO
+        from rpi_hardware_pwm import HardwarePWM
+
+        self._gpio = GPIO
+        GPIO.setmode(GPIO.BOARD)
+        GPIO.setup(RaspberryPiHardware.PUMP_PIN, GPIO.OUT)
+        GPIO.setup(RaspberryPiHardware.BUZZER_PIN, GPIO.OUT)
+        GPIO.setup(RaspberryPiHardware.FAN_TACH_PIN, GPIO.IN, pull_up_down=GPIO.PUD_OFF)
+
+        self._fan_pwm = HardwarePWM(pwm_channel=0, hz=20000, chip=0)
+        self._fan_pwm.start(100)
+
+        self._heater_pwm = HardwarePWM(pwm_channel=1, hz=50, chip=0)
+        self._heater_pwm.start(0)
+
+        self._software_pwms = {}
+
+        self._bus = W1Bus()
+
+    def discover_sensors(self):
+        return self._bus.discover()
+
+    def read_temperatures(self, names):
+        return self._bus.read(names)
+
+    def set_resolution(self, name, bits):
+        return self._bus.set_resolution(name, bits)
+
+    def heater(self, pin=None, sensor=None):
+        """Get the function setting the duty cycle of a heater.
+
+        Args:
+            pin (int): The board pin of a heater driven with software PWM,
+                the hardware PWM heater if not specified.
+            sensor (str): The sensor measuring what the heater heats, unused
+                on real hardware.
+        """
+        if pin is None:
+            return self._heater_pwm.change_duty_cycle
+        if pin not in self._software_pwms:
+            self._gpio.setup(pin, self._gpio.OUT)
+            pwm = self._gpio.PWM(pin, RaspberryPiHardware.SOFTWARE_PWM_FREQUENCY)
+            pwm.start(0)
+            self._software_pwms[pin] = pwm
+        return self._software_pwms[pin].ChangeDutyCycle
+
+    def set_fan(self, duty_cycle):
+        self._fan_pwm.change_duty_cycle(duty_cycle)
+
+    def set_pump(self, on):
+        self._gpio.output(RaspberryPiHardware.PUMP_PIN, self._gpio.HIGH if on else self._gpio.LOW)
+
+    def set_buzzer(self, on):
+        self._gpio.output(RaspberryPiHardware.BUZZER_PIN, self._gpio.HIGH if on else self._gpio.LOW)
+
+    def set_tach_callback(self, callback):
+        self._gpio.add_event_detect(RaspberryPiHardware.FAN_TACH_PIN, self._gpio.RISING, callback=lambda channel: callback())
+
+class SimulatedHardware(object):
+    """Hardware backed by simulated kettles, for running the controller
+    without a Raspberry Pi.
+
+    The kettles are advanced to the current clock time whenever a heater or
+    the sensors are used. Sensors convert for as long as a DS18B20 at their
+    resolution does.
+
+    Args:
+        kettles (dict): The simulated plants by the name of their sensor.
+        clock (Clock): The clock the rest of the controller uses.
+    """
+
+    def __init__(self, kettles, clock):
+        if not kettles:
+            raise ValueError('kettles must not be empty')
+
+        self._kettles = dict(kettles)
+        self._clock = clock
+        self._resolutions = {name: DEFAULT_RESOLUTION for name in self._kettles}
+        self._lock = threading.Lock()
+        self._sleep_event = threading.Event()
+        self._last_advance = clock.monotonic()
+        self.fan_duty_cycle = 0.0
+        self.pump = False
+        self.buzzer = False
+
+    @property
+    def kettles(self):
+        return self._kettles
+
+    def discover_sensors(self):
+        return sorted(self._kettles)
+
+    def read_temperatures(self, names):
+        # all sensors convert at the same time like a bulk read on the real bus, the slowest one sets the pace
+        resolutions = [self._resolutions[name] for name in names if name in self._resolutions]
+        self._clock.wait(self._sleep_event, max((CONVERSION_TIMES[bits] for bits in resolutions), default=0.0))
+        with self._lock:
+            self._advance()
+            return {name: self._kettles[name].read_sensor(RESOLUTION_STEPS[self._resolutions[name]])
+                    if name in self._kettles else None for name in names}
+
+    def set_resolution(self, name, bits):
+        if name not in self._kettles:
+            return False
+        self._resolutions[name] = bits
+        return True
+
+    def heater(self, pin=None, sensor=None):
+        """Get the function setting the duty cycle of the kettle measured by
+        `sensor`, or of the first kettle if not specified."""
+        kettle = self._kettles[sensor if sensor is not None else self.discover_sensors()[0]]
+
+        def set_heater(duty_cycle):
+            with self._lock:
+                self._advance()
+                kettle.duty_cycle = duty_cycle
+        return set_heater
+
+    def set_fan(self, duty_cycle):
+        self.fan_duty_cycle = duty_cycle
+
+    def set_pump(self, on):
+        self.pump = on
+
+    def set_buzzer(self, on):
+        self.buzzer = on
+
+    def set_tach_callback(self, callback):
+        pass
+
+    def _advance(self):
+        now = self._clock.monotonic()
+        for kettle in self._kettles.values():
+            kettle.advance(now - self._last_advance)
+        self._last_advance = now
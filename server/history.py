@@ -0,0 +1,129 @@
+import math
+from array import array
+
+class History(object):
+    """Fixed capacity ring buffer of samples stored in typed columns.
+
+    Every field gets its own preallocated array, so appending and evicting a
+    sample is O(1) and memory use doesn't depend on the values. Missing float
+    values are stored as NaN.
+
+    Samples are numbered by a cursor which is the count of samples ever
+    appended. A reader that remembers the cursor can later ask for just the
+    samples appended after it.
+
+    Args:
+        capacity (int): The maximum number of samples kept.
+        fields (list): (name, typecode) pairs, typecodes as used by `array`.
+    """
+
+    def __init__(self, capacity, fields):
+        if capacity < 1:
+            raise ValueError('capacity must be greater or equal to 1')
+        if len(fields) == 0:
+            raise ValueError('fields must be specified')
+
+        self._capacity = capacity
+        self._fields = tuple(name for name, _ in fields)
+        self._columns = {}
+        for name, typecode in fields:
+            fill = math.nan if typecode in 'fd' else 0
+            self._columns[name] = array(typecode, [fill]) * capacity
+        self._head = 0
+        self._length = 0
+        self._cursor = 0
+
+    def __len__(self):
+        return self._length
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def fields(self):
+        return self._fields
+
+    @property
+    def cursor(self):
+        return self._cursor
+
+    @property
+    def first_cursor(self):
+        return self._cursor - self._length
+
+    def append(self, *values):
+        """Append a sample, evicting the oldest one when full.
+
+        Args:
+            values: One value per field in field order, `None` for missing values.
+        """
+        head = self._head
+        for name, value in zip(self._fields, values):
+            self._columns[name][head] = math.nan if value is None else value
+        self._head = (head + 1) % self._capacity
+        if self._length < self._capacity:
+            self._length += 1
+        self._cursor += 1
+
+    def copy(self):
+        """Copy the samples into a new History with the same cursors, which
+        later appends to this one don't change."""
+        copy = History.__new__(History)
+        copy._capacity = self._capacity
+        copy._fields = self._fields
+        copy._columns = {name: column[:] for name, column in self._columns.items()}
+        copy._head = self._head
+        copy._length = self._length
+        copy._cursor = self._cursor
+        return copy
+
+    def clear(self):
+        self._head = 0
+        self._length = 0
+        # skip a cursor value so that readers holding cursors into the cleared samples can't continue from them
+        self._cursor += 1
+
+    def is_continuous(self, since):
+        """Check whether all samples appended after a cursor are still available."""
+        return since is not None and self.first_cursor <= since <= self._cursor
+
+    def views(self, name, count=None):
+        """Get zero-copy views of the last samples of a field, oldest first.
+
+        Args:
+            name (str): The field.
+            count (int): The number of samples, all samples if not specified.
+
+        Returns:
+            A list of at most two memoryviews, which are only valid until the
+            next append.
+        """
+        count = self._length if count is None else max(0, min(count, self._length))
+        column = memoryview(self._columns[name])
+        start = (self._head - count) % self._capacity
+        if start + count <= self._capacity:
+            return [column[start:start + count]]
+        return [column[start:], column[:self._head]]
+
+    def tail(self, count=None):
+        """Copy the last samples of every field into new arrays.
+
+        Args:
+            count (int): The number of samples, all samples if not specified.
+
+        Returns:
+            A dict of field name to array.
+        """
+        result = {}
+        for name in self._fields:
+            copy = array(self._columns[name].typecode)
+            for view in self.views(name, count):
+                copy.frombytes(view.cast('B'))
+            result[name] = copy
+        return result
+
+    @staticmethod
+    def to_list(values):
+        """Convert values to a JSON serializable list with NaN as `None`."""
+        return [None if value != value else value for value in values]
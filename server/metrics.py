@@ -0,0 +1,188 @@
+import math
+import threading
+from array import array
+from time import perf_counter
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels) + '}'
+
+def _format_value(value):
+    if value != value:
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+class Counter(object):
+    """A monotonically increasing count."""
+
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+
+    @property
+    def value(self):
+        return self._value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def _samples(self, name, labels):
+        return [(name, labels, self._value)]
+
+class Summary(object):
+    """Tracks the count, sum and maximum of all observations and quantiles of
+    the most recent ones.
+
+    Observations are kept in a fixed size ring, so observing is O(1) and the
+    quantiles are only computed when they are read.
+
+    Args:
+        window (int): How many recent observations quantiles are computed from.
+    """
+    QUANTILES = (0.5, 0.95, 0.99)
+
+    def __init__(self, window=1024):
+        self._window = array('d', [0.0]) * window
+        self._index = 0
+        self._count = 0
+        self._sum = 0.0
+        self._max = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def max(self):
+        return self._max
+
+    def observe(self, value):
+        with self._lock:
+            self._window[self._index] = value
+            self._index = (self._index + 1) % len(self._window)
+            self._count += 1
+            self._sum += value
+            if value > self._max:
+                self._max = value
+
+    def time(self):
+        """Observe the duration of a `with` block in seconds."""
+        return _Timer(self)
+
+    def quantiles(self, quantiles=QUANTILES):
+        with self._lock:
+            values = sorted(self._window[:min(self._count, len(self._window))])
+        if not values:
+            return [math.nan for _ in quantiles]
+        return [values[min(len(values) - 1, int(quantile * len(values)))] for quantile in quantiles]
+
+    def _samples(self, name, labels):
+        samples = []
+        for quantile, value in zip(Summary.QUANTILES, self.quantiles()):
+            samples.append((name, labels + (('quantile', str(quantile)),), value))
+        samples.append((name + '_sum', labels, self._sum))
+        samples.append((name + '_count', labels, self._count))
+        return samples
+
+class _Timer(object):
+    def __init__(self, summary):
+        self._summary = summary
+
+    def __enter__(self):
+        self._started = perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self._summary.observe(perf_counter() - self._started)
+
+class Registry(object):
+    """Collects metrics and renders them in the Prometheus text format."""
+
+    def __init__(self):
+        self._families = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, help, **labels):
+        # the family of a counter is named like its sample, with the _total suffix
+        if not name.endswith('_total'):
+            name += '_total'
+        return self._get(name, help, 'counter', Counter, labels)
+
+    def summary(self, name, help, **labels):
+        return self._get(name, help, 'summary', Summary, labels)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            families = list(self._families.items())
+        for name, (help, type, metrics) in families:
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {type}')
+            for labels, metric in list(metrics.items()):
+                for sample_name, sample_labels, value in metric._samples(name, labels):
+                    lines.append(f'{sample_name}{_format_labels(sample_labels)} {_format_value(value)}')
+            if type == 'summary':
+                # the text format has no place for a maximum in a summary, it gets a gauge of its own
+                lines.append(f'# HELP {name}_max Maximum of: {help}')
+                lines.append(f'# TYPE {name}_max gauge')
+                for labels, metric in list(metrics.items()):
+                    lines.append(f'{name}_max{_format_labels(labels)} {_format_value(metric.max)}')
+        return '\n'.join(lines) + '\n'
+
+    def _get(self, name, help, type, factory, labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            family = self._families.setdefault(name, (help, type, {}))
+            if family[1] != type:
+                raise ValueError(f'{name} is already registered as a {family[1]}')
+            metric = family[2].get(key)
+            if metric is None:
+                metric = factory()
+                family[2][key] = metric
+            return metric
+
+class TimedLock(object):
+    """A lock which records how long it was waited for and held.
+
+    Args:
+        registry (Registry): Where the wait and hold times are recorded.
+        name (str): The lock label of the metrics.
+        role (function): Returns the role label of the current acquirer, so
+            that for example the control loop and HTTP handlers are told apart.
+    """
+
+    def __init__(self, registry, name, role):
+        self._lock = threading.Lock()
+        self._registry = registry
+        self._name = name
+        self._role = role
+        self._summaries = {}
+        self._local = threading.local()
+
+    def __enter__(self):
+        wait, hold = self._get_summaries(self._role())
+        started = perf_counter()
+        self._lock.acquire()
+        acquired = perf_counter()
+        wait.observe(acquired - started)
+        self._local.held = (hold, acquired)
+        return self
+
+    def __exit__(self, *args):
+        hold, acquired = self._local.held
+        self._lock.release()
+        hold.observe(perf_counter() - acquired)
+
+    def _get_summaries(self, role):
+        summaries = self._summaries.get(role)
+        if summaries is None:
+            summaries = (
+                self._registry.summary('brew_lock_wait_seconds', 'Time spent waiting for a lock', lock=self._name, role=role),
+                self._registry.summary('brew_lock_hold_seconds', 'Time a lock was held', lock=self._name, role=role))
+            self._summaries[role] = summaries
+        return summaries
@@ -1,6 +1,27 @@
 from time import time
 import logging
 
+class PIDState(object):
+    """The terms of the last PID calculation.
+
+    The record is updated in place by every calculation, so sampling it
+    doesn't allocate, use `copy()` to keep a value.
+    """
+    __slots__ = ('error', 'p', 'i', 'd', 'output')
+
+    def __init__(self, error=0.0, p=0.0, i=0.0, d=0.0, output=0.0):
+        self.error = error
+        self.p = p
+        self.i = i
+        self.d = d
+        self.output = output
+
+    def copy(self):
+        return PIDState(self.error, self.p, self.i, self.d, self.output)
+
+    def __repr__(self):
+        return f'PIDState(error={self.error}, p={self.p}, i={self.i}, d={self.d}, output={self.output})'
+
 class PID(object):
 
     def __init__(self, sampletime, kp, ki, kd, out_min=0.0,
@@ -24,43 +45,123 @@ class PID(object):
         self._out_min = out_min
         self._out_max = out_max
         self._integral = 0
-        self._last_input = 0
+        # no derivative on the first calculation instead of a kick from an input of 0
+        self._last_input = None
+        # seconds since the input the derivative was last taken from
+        self._derivative_elapsed = 0.0
         self._last_output = 0
         self._last_calc_timestamp = 0
+        self._state = PIDState()
         self._time = time
 
-    def calc(self, input_val, setpoint):
+    @property
+    def state(self):
+        """The `PIDState` of the last calculation."""
+        return self._state
+
+    @property
+    def is_saturated(self):
+        """Whether the last output was at one of the output limits."""
+        return self._last_output <= self._out_min or self._last_output >= self._out_max
+
+    def set_tunings(self, kp, ki, kd):
+        """Change the gains without resetting the integral, the integral is
+        kept as an output value, so the output doesn't jump either."""
+        if kp is None or ki is None or kd is None:
+            raise ValueError('kp, ki and kd must be specified')
+        self._Kp = kp
+        self._Ki = ki * self._sampletime / 1000
+        self._Kd = kd / (self._sampletime / 1000)
+
+    def initialize(self, input_val, output):
+        """Take over from another controller without a bump, the integral
+        starts at the output it left behind.
+
+        Args:
+            input_val (float): The current input value.
+            output (float): The output of the previous controller.
+        """
+        self._integral = min(max(output, self._out_min), self._out_max)
+        self._last_input = input_val
+        self._derivative_elapsed = 0.0
+        self._last_output = self._integral
+
+    def checkpoint(self):
+        """Get the controller state as a dict which can be serialized."""
+        return dict(integral=self._integral, last_input=self._last_input, last_output=self._last_output)
+
+    def restore(self, checkpoint):
+        """Continue from the state returned by `checkpoint()`."""
+        self._integral = checkpoint['integral']
+        self._last_input = checkpoint['last_input']
+        self._derivative_elapsed = 0.0
+        self._last_output = checkpoint['last_output']
+
+    def calc(self, input_val, setpoint, dt=None, new_input=True):
+        """Calculate the output.
+
+        Args:
+            input_val (float): The input value.
+            setpoint (float): The target value.
+            dt (float): The seconds since the last calculation, the output is
+                only calculated every sample time if not specified.
+            new_input (bool): Whether the input was measured since the last
+                calculation. An input which is only measured every few
+                calculations keeps the derivative of the last measurement,
+                the next one is taken over the time between measurements
+                instead of landing on a single calculation.
+        """
         now = self._time() * 1000
 
-        if (now - self._last_calc_timestamp) < self._sampletime:
-            return self._last_output
+        if dt is None:
+            if (now - self._last_calc_timestamp) < self._sampletime:
+                return self._last_output
+            ki = self._Ki
+            dt = self._sampletime / 1000
+        else:
+            # Scale the gains to the actual time elapsed since the last calculation
+            if dt <= 0:
+                return self._last_output
+            ki = self._Ki * dt * 1000 / self._sampletime
+        self._derivative_elapsed += dt
 
         # Compute all the working error variables
         error = setpoint - input_val
-        input_diff = input_val - self._last_input
 
         # In order to prevent windup, only integrate if the process is not saturated
         if self._last_output < self._out_max and self._last_output > self._out_min:
-            self._integral += self._Ki * error
+            self._integral += ki * error
             self._integral = min(self._integral, self._out_max)
             self._integral = max(self._integral, self._out_min)
 
         p = self._Kp * error
         i = self._integral
-        d = -(self._Kd * input_diff)
+        if not new_input:
+            d = self._state.d
+        elif self._last_input is None:
+            d = 0.0
+        else:
+            kd = self._Kd * self._sampletime / 1000 / self._derivative_elapsed
+            d = -(kd * (input_val - self._last_input))
 
         # Compute PID Output
         self._last_output = p + i + d
         self._last_output = min(self._last_output, self._out_max)
         self._last_output = max(self._last_output, self._out_min)
 
-        # Log some debug info
-        self._logger.debug('P: {0}'.format(p))
-        self._logger.debug('I: {0}'.format(i))
-        self._logger.debug('D: {0}'.format(d))
-        self._logger.debug('output: {0}'.format(self._last_output))
+        # Log some debug info, the check keeps the arguments from being collected when debug logging is off
+        if self._logger.isEnabledFor(logging.DEBUG):
+            self._logger.debug('P: %s, I: %s, D: %s, output: %s', p, i, d, self._last_output)
 
         # Remember some variables for next time
-        self._last_input = input_val
+        state = self._state
+        state.error = error
+        state.p = p
+        state.i = i
+        state.d = d
+        state.output = self._last_output
+        if new_input:
+            self._last_input = input_val
+            self._derivative_elapsed = 0.0
         self._last_calc_timestamp = now
         return self._last_output
\ No newline at end of file
@@ -0,0 +1,96 @@
+import threading
+import logging
+from clock import Clock
+
+class ControlScheduler(object):
+    """Calls a function periodically on absolute deadlines of a monotonic clock.
+
+    Deadlines are multiples of the period from the start, so a late tick
+    doesn't push back the following ones. When a tick overruns one or more
+    deadlines, the catch up policy decides what happens to them.
+
+    Args:
+        function (function): Called with the clock seconds elapsed since the
+            previous call, or the period on the first call.
+        period (float): The interval between deadlines in clock seconds.
+        catch_up (str): `CATCH_UP_SKIP` drops missed deadlines and continues
+            from the next one, `CATCH_UP_BURST` runs missed ticks back to back
+            until the schedule is caught up.
+        max_burst (int): How many missed ticks are run at most with
+            `CATCH_UP_BURST`, older ones are dropped.
+        on_overrun (function): Called with the number of dropped ticks.
+        clock (Clock): The clock to measure and wait with.
+    """
+    CATCH_UP_SKIP = 'skip'
+    CATCH_UP_BURST = 'burst'
+
+    def __init__(self, function, period, catch_up=CATCH_UP_SKIP, max_burst=3,
+                 on_overrun=None, clock=Clock()):
+        if period <= 0:
+            raise ValueError('period must be greater than 0')
+        if catch_up not in (ControlScheduler.CATCH_UP_SKIP, ControlScheduler.CATCH_UP_BURST):
+            raise ValueError('catch_up must be CATCH_UP_SKIP or CATCH_UP_BURST')
+        if max_burst < 1:
+            raise ValueError('max_burst must be greater or equal to 1')
+
+        self._logger = logging.getLogger(type(self).__name__)
+        self._function = function
+        self._period = period
+        self._catch_up = catch_up
+        self._max_burst = max_burst
+        self._on_overrun = on_overrun
+        self._clock = clock
+        self._lateness = 0.0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @property
+    def period(self):
+        return self._period
+
+    @property
+    def lateness(self):
+        """How late the current or last tick started in clock seconds."""
+        return self._lateness
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='control-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        clock = self._clock
+        deadline = clock.monotonic() + self._period
+        previous_start = None
+        while True:
+            if clock.wait(self._stop_event, deadline - clock.monotonic()):
+                return
+            started = clock.monotonic()
+            self._lateness = started - deadline
+            elapsed = self._period if previous_start is None else started - previous_start
+            previous_start = started
+            try:
+                self._function(elapsed)
+            except Exception:
+                self._logger.exception('control tick failed')
+
+            deadline += self._period
+            # deadlines which have already passed, the latest one is run right away
+            passed = int((clock.monotonic() - deadline) // self._period) + 1
+            if passed <= 1:
+                continue
+            dropped = passed - 1 if self._catch_up == ControlScheduler.CATCH_UP_SKIP else max(0, passed - self._max_burst)
+            if dropped > 0:
+                deadline += dropped * self._period
+                self._logger.warning('control loop overran, dropped %d ticks', dropped)
+                if self._on_overrun is not None:
+                    self._on_overrun(dropped)
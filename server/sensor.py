@@ -0,0 +1,325 @@
+import os
+import glob
+import re
+import threading
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from clock import Clock
+
+# DS18B20 resolutions in bits with their step in °C and the longest conversion time in seconds
+RESOLUTION_STEPS = {9: 0.5, 10: 0.25, 11: 0.125, 12: 0.0625}
+CONVERSION_TIMES = {9: 0.09375, 10: 0.1875, 11: 0.375, 12: 0.75}
+DEFAULT_RESOLUTION = 12
+
+class SysfsFile(object):
+    """A sysfs attribute which is kept open and read with pread at offset 0,
+    which makes the kernel produce a fresh value without reopening the file.
+
+    After a failed read the file is closed and not reopened before a backoff
+    has passed, which doubles with each further failure.
+
+    Args:
+        path (str): The attribute file.
+        size (int): The maximum number of bytes read.
+        min_backoff (float): The time before the first retry in seconds.
+        max_backoff (float): The longest time between retries in seconds.
+        clock (Clock): The clock to measure the backoff with.
+    """
+
+    def __init__(self, path, size=256, min_backoff=1.0, max_backoff=60.0, clock=Clock()):
+        if min_backoff <= 0:
+            raise ValueError('min_backoff must be greater than 0')
+        if max_backoff < min_backoff:
+            raise ValueError('max_backoff must be greater or equal to min_backoff')
+
+        self._path = path
+        self._size = size
+        self._min_backoff = min_backoff
+        self._max_backoff = max_backoff
+        self._clock = clock
+        self._fd = None
+        self._backoff = min_backoff
+        self._retry_at = None
+
+    @property
+    def path(self):
+        return self._path
+
+    def read(self):
+        """Read the attribute, raises `OSError` if it failed or is backing off."""
+        if self._fd is None:
+            if self._retry_at is not None and self._clock.monotonic() < self._retry_at:
+                raise OSError(f'{self._path} is backing off after an error')
+            try:
+                self._fd = os.open(self._path, os.O_RDONLY)
+            except OSError:
+                self._fail()
+                raise
+        try:
+            data = os.pread(self._fd, self._size, 0)
+        except OSError:
+            self.close()
+            self._fail()
+            raise
+        self._backoff = self._min_backoff
+        self._retry_at = None
+        return data
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _fail(self):
+        self._retry_at = self._clock.monotonic() + self._backoff
+        self._backoff = min(self._backoff * 2, self._max_backoff)
+
+class W1Bus(object):
+    """Reads the DS18B20 sensors on the 1-Wire bus.
+
+    Sensors are discovered once and cached, errors trigger a rediscovery at
+    most every `rediscover_interval` seconds so hotplugged sensors are noticed.
+    When the kernel driver supports it, all sensors are told to convert at the
+    same time through therm_bulk_read, otherwise they are read in parallel
+    threads, so reading several sensors takes about one conversion time.
+
+    Args:
+        rediscover_interval (float): The shortest time between two
+            rediscoveries in seconds.
+        clock (Clock): The clock to measure backoffs with.
+    """
+    BASE_DIR = '/sys/bus/w1/devices/'
+    BULK_READ_FILE = BASE_DIR + 'w1_bus_master1/therm_bulk_read'
+    PATTERN = re.compile(rb't=(-?\d+)')
+
+    def __init__(self, rediscover_interval=10.0, clock=Clock()):
+        self._logger = logging.getLogger(type(self).__name__)
+        self._rediscover_interval = rediscover_interval
+        self._clock = clock
+        self._sensors = None
+        self._rediscover_at = None
+        self._files = {}
+        self._resolutions = {}
+        self._executor = None
+
+    def discover(self):
+        if self._sensors is None:
+            self._rediscover()
+        return self._sensors
+
+    def read(self, names):
+        """Read sensors, returns a dict of name to temperature or `None`."""
+        if len(names) <= 1 or self._trigger_bulk_read():
+            # after a bulk conversion the sensors return the converted value without converting again
+            temperatures = {name: self._read_sensor(name) for name in names}
+        else:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=len(names), thread_name_prefix='w1-read')
+            temperatures = dict(zip(names, self._executor.map(self._read_sensor, names)))
+        if None in temperatures.values():
+            self._rediscover_later()
+        return temperatures
+
+    def set_resolution(self, name, bits):
+        """Set the resolution of a sensor through the w1-therm resolution
+        attribute, which only changes the scratchpad, not the EEPROM.
+
+        Returns:
+            `True` if the sensor has the resolution, `False` if the kernel
+            driver doesn't support setting it or the write failed.
+        """
+        if bits not in RESOLUTION_STEPS:
+            raise ValueError('bits must be 9, 10, 11 or 12')
+        if self._resolutions.get(name) == bits:
+            return True
+        try:
+            with open(W1Bus.BASE_DIR + name + '/resolution', 'w') as file:
+                file.write(str(bits))
+        except OSError:
+            self._resolutions.pop(name, None)
+            return False
+        self._resolutions[name] = bits
+        return True
+
+    def _rediscover(self):
+        sensors = sorted(os.path.basename(folder) for folder in glob.glob(W1Bus.BASE_DIR + '28*'))
+        if self._sensors is None:
+            self._logger.info('found sensors: %s', ', '.join(sensors))
+        elif sensors != self._sensors:
+            self._logger.info('sensors changed, added: %s, removed: %s',
+                              ', '.join(set(sensors) - set(self._sensors)), ', '.join(set(self._sensors) - set(sensors)))
+        # files of sensors which came or went are opened again, the attribute they provide may differ
+        for name in set(sensors) ^ set(self._sensors or []):
+            file = self._files.pop(name, None)
+            if file is not None:
+                file.close()
+            # a sensor which lost power is back at the resolution stored in its EEPROM
+            self._resolutions.pop(name, None)
+        self._sensors = sensors
+
+    def _rediscover_later(self):
+        now = self._clock.monotonic()
+        if self._rediscover_at is None or now >= self._rediscover_at:
+            self._rediscover_at = now + self._rediscover_interval
+            self._rediscover()
+
+    def _trigger_bulk_read(self):
+        try:
+            with open(W1Bus.BULK_READ_FILE, 'w') as file:
+                file.write('trigger')
+            return True
+        except OSError:
+            return False
+
+    def _read_sensor(self, name):
+        file = self._files.get(name)
+        if file is None:
+            # newer kernels have a temperature attribute which is just the value in millidegrees
+            path = W1Bus.BASE_DIR + name + '/temperature'
+            if not os.path.exists(path):
+                path = W1Bus.BASE_DIR + name + '/w1_slave'
+            file = SysfsFile(path, clock=self._clock)
+            self._files[name] = file
+        try:
+            data = file.read()
+        except OSError:
+            return None
+        if file.path.endswith('/temperature'):
+            try:
+                return int(data)/1000
+            except ValueError:
+                return None
+        result = W1Bus.PATTERN.search(data)
+        if result is None:
+            return None
+        return int(result.group(1))/1000
+
+class TemperatureSampler(object):
+    """Reads temperature sensors in a background thread.
+
+    The kernel blocks reads of w1_slave for a full conversion, so the sensors
+    are owned by this thread and consumers only ever look at the latest
+    published readings. Resolution changes are requested from any thread and
+    applied by this one before its next reading, so they never wait for a
+    conversion either.
+
+    At full resolution the sensors are read every `interval`, coarser
+    resolutions convert faster and are read more often, the interval shrinks
+    with the conversion time of the slowest sensor down to `min_interval`.
+
+    Args:
+        read (function): Reads the sensors, returns a dict of sensor name to
+            temperature or `None`.
+        interval (float): The time between the starts of two readings at full
+            resolution in seconds.
+        min_interval (float): The shortest time between the starts of two
+            readings in seconds, `interval` to always read at that interval.
+        max_age (float): How old a reading can get before it is considered stale.
+        set_resolution (function): Sets the resolution of a sensor in bits,
+            returns `False` if that isn't supported. `None` if sensors keep
+            their resolution.
+        clock (Clock): The clock to measure and wait with.
+    """
+    Reading = namedtuple('Reading', ['temperature', 'timestamp', 'error', 'resolution'])
+    NO_READING = Reading(None, None, True, None)
+
+    def __init__(self, read, interval=1.0, max_age=3.0, set_resolution=None, clock=Clock(), min_interval=None):
+        if interval <= 0:
+            raise ValueError('interval must be greater than 0')
+        if min_interval is not None and (min_interval <= 0 or min_interval > interval):
+            raise ValueError('min_interval must be greater than 0 and less or equal to interval')
+        if max_age < interval:
+            raise ValueError('max_age must be greater or equal to interval')
+
+        self._logger = logging.getLogger(type(self).__name__)
+        self._read = read
+        self._interval = interval
+        self._min_interval = interval if min_interval is None else min_interval
+        self._max_age = max_age
+        self._set_resolution = set_resolution
+        self._clock = clock
+        self._readings = {}
+        self._requested_resolutions = {}
+        self._resolutions = {}
+        self._failed_resolutions = {}
+        self._ready_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def reading(self, name):
+        return self._readings.get(name, TemperatureSampler.NO_READING)
+
+    def request_resolution(self, name, bits):
+        """Request a sensor resolution in bits, applied before the next reading."""
+        if bits not in RESOLUTION_STEPS:
+            raise ValueError('bits must be 9, 10, 11 or 12')
+        self._requested_resolutions[name] = bits
+
+    def wait_ready(self, timeout):
+        """Wait until the first readings are published, returns `true` if they were."""
+        return self._clock.wait(self._ready_event, timeout)
+
+    @property
+    def interval(self):
+        """The time between the starts of two readings at the current
+        resolutions in seconds."""
+        # sensors which can't be set convert at whatever resolution they have, which may be the slowest
+        conversion_time = max((CONVERSION_TIMES[self._resolutions.get(name, DEFAULT_RESOLUTION)] for name in self._readings),
+                              default=CONVERSION_TIMES[DEFAULT_RESOLUTION])
+        return max(self._min_interval, self._interval * conversion_time / CONVERSION_TIMES[DEFAULT_RESOLUTION])
+
+    def is_stale(self, reading):
+        return reading.timestamp is None or self._clock.monotonic() - reading.timestamp > self._max_age
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='temperature-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            started = self._clock.monotonic()
+            self._apply_resolutions()
+            try:
+                temperatures = self._read()
+            except Exception:
+                self._logger.debug('reading temperatures failed', exc_info=True)
+                temperatures = {name: None for name in self._readings}
+            timestamp = self._clock.monotonic()
+            # readings are immutable, swapping the reference is enough for readers on other threads
+            self._readings = {name: TemperatureSampler.Reading(temperature, timestamp, temperature is None,
+                                                               self._resolutions.get(name))
+                              for name, temperature in temperatures.items()}
+            self._ready_event.set()
+            self._clock.wait(self._stop_event, self.interval - (self._clock.monotonic() - started))
+
+    def _apply_resolutions(self):
+        if self._set_resolution is None:
+            return
+        for name, bits in list(self._requested_resolutions.items()):
+            if self._resolutions.get(name) == bits or self._failed_resolutions.get(name) == bits:
+                continue
+            try:
+                applied = self._set_resolution(name, bits)
+            except Exception:
+                self._logger.debug('setting the resolution of %s failed', name, exc_info=True)
+                applied = False
+            if applied:
+                self._logger.info('%s resolution set to %d bits', name, bits)
+                self._resolutions[name] = bits
+                self._failed_resolutions.pop(name, None)
+            else:
+                # not retried until a different resolution is requested, the resolution of the sensor is unknown now
+                self._logger.warning('setting the resolution of %s to %d bits failed', name, bits)
+                self._resolutions.pop(name, None)
+                self._failed_resolutions[name] = bits
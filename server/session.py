@@ -0,0 +1,213 @@
+import os
+import mmap
+import queue
+import struct
+import threading
+import logging
+from time import monotonic
+
+MAGIC = b'BREWLOG1'
+HEADER = struct.Struct('<8sHH4x')
+# timestamp, temperature, setpoint, duty cycle, mode, pump, P, I, D
+RECORD = struct.Struct('<qdddBB6xddd')
+FIELDS = ('timestamp', 'temperature', 'setpoint', 'dutyCycle', 'mode', 'pump', 'p', 'i', 'd')
+MODES = ('off', 'auto', 'manual', 'boil', 'tuning')
+UNKNOWN_MODE = 255
+EXTENSION = '.session'
+
+class SessionWriter(object):
+    """Appends one fixed size record per control tick to a session file.
+
+    Records are handed to a background thread which writes and fsyncs them in
+    batches, so appending never waits for the SD card. The thread also
+    creates the file and deletes the oldest sessions of the directory beyond
+    the retention limits before the first write, so starting doesn't either.
+
+    Args:
+        path (str): The session file, created if it doesn't exist.
+        sync_interval (float): How often buffered records are written and
+            synced to disk in seconds.
+        max_sessions (int): How many sessions the directory keeps, this one
+            included, unlimited if not specified.
+        max_bytes (int): How many bytes the sessions of the directory may
+            take up when this one starts, unlimited if not specified.
+    """
+
+    def __init__(self, path, sync_interval=10.0, max_sessions=None, max_bytes=None):
+        if sync_interval <= 0:
+            raise ValueError('sync_interval must be greater than 0')
+        if max_sessions is not None and max_sessions < 1:
+            raise ValueError('max_sessions must be at least 1')
+        if max_bytes is not None and max_bytes < 0:
+            raise ValueError('max_bytes must not be negative')
+
+        self._logger = logging.getLogger(type(self).__name__)
+        self._path = path
+        self._sync_interval = sync_interval
+        self._max_sessions = max_sessions
+        self._max_bytes = max_bytes
+        self._records = queue.SimpleQueue()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @property
+    def path(self):
+        return self._path
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='session-writer', daemon=True)
+        self._thread.start()
+
+    def stop(self, wait=True):
+        """Write the remaining records and close the file.
+
+        Args:
+            wait (bool): Whether to wait until the records are synced, the
+                thread finishes on its own otherwise.
+        """
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        if wait:
+            self._thread.join()
+        self._thread = None
+
+    def append(self, timestamp, temperature, setpoint, duty_cycle, mode, pump, p, i, d):
+        """Queue a record, `None` values are stored as NaN."""
+        nan = float('nan')
+        self._records.put(RECORD.pack(
+            timestamp,
+            nan if temperature is None else temperature,
+            nan if setpoint is None else setpoint,
+            duty_cycle,
+            MODES.index(mode) if mode in MODES else UNKNOWN_MODE,
+            pump,
+            nan if p is None else p,
+            nan if i is None else i,
+            nan if d is None else d))
+
+    def _run(self):
+        directory = os.path.dirname(self._path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if self._max_sessions is not None or self._max_bytes is not None:
+            for name in prune_sessions(directory or '.', self._max_sessions, self._max_bytes,
+                                       os.path.basename(self._path)):
+                self._logger.info('deleted session %s', name)
+        with open(self._path, 'ab') as file:
+            if file.tell() == 0:
+                file.write(HEADER.pack(MAGIC, 1, RECORD.size))
+                file.flush()
+            while True:
+                stopping = self._stop_event.wait(self._sync_interval)
+                chunk = bytearray()
+                while not self._records.empty():
+                    chunk += self._records.get()
+                if chunk:
+                    started = monotonic()
+                    file.write(chunk)
+                    file.flush()
+                    os.fsync(file.fileno())
+                    self._logger.debug('synced %d bytes in %.3f s', len(chunk), monotonic() - started)
+                if stopping:
+                    return
+
+def list_sessions(directory):
+    """List session files in a directory, oldest first."""
+    sessions = []
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return sessions
+    for name in names:
+        if not name.endswith(EXTENSION):
+            continue
+        size = os.path.getsize(os.path.join(directory, name))
+        sessions.append(dict(name=name[:-len(EXTENSION)], records=max(0, size - HEADER.size) // RECORD.size))
+    sessions.sort(key=lambda session: session["name"])
+    return sessions
+
+def prune_sessions(directory, max_sessions=None, max_bytes=None, keep=None):
+    """Delete the oldest session files of a directory until at most
+    `max_sessions` of them are left and they take up at most `max_bytes`.
+
+    Args:
+        directory (str): The directory of the session files.
+        max_sessions (int): How many sessions are kept, unlimited if not
+            specified.
+        max_bytes (int): How many bytes the kept sessions may take up,
+            unlimited if not specified.
+        keep (str): The file name of a session which is never deleted and
+            counts towards the limits, the one being recorded.
+
+    Returns:
+        The names of the deleted sessions.
+    """
+    files = []
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    for name in names:
+        if not name.endswith(EXTENSION):
+            continue
+        try:
+            size = os.path.getsize(os.path.join(directory, name))
+        except FileNotFoundError:
+            continue
+        files.append((name, size))
+    # names start with the start time, so they sort oldest first
+    files.sort()
+    if keep is not None and keep not in (name for name, _ in files):
+        files.append((keep, HEADER.size))
+    count = len(files)
+    total = sum(size for _, size in files)
+    deleted = []
+    for name, size in files:
+        if (max_sessions is None or count <= max_sessions) and (max_bytes is None or total <= max_bytes):
+            break
+        if name == keep:
+            continue
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+        count -= 1
+        total -= size
+        deleted.append(name[:-len(EXTENSION)])
+    return deleted
+
+def read_session(path, start=0, count=None):
+    """Read a range of records from a session file without loading all of it.
+
+    Args:
+        path (str): The session file.
+        start (int): Index of the first record, negative values count from the end.
+        count (int): Maximum number of records, all remaining if not specified.
+
+    Returns:
+        A tuple of the total record count and a dict of field name to a list
+        of values, NaN values are returned as `None`.
+    """
+    columns = {field: [] for field in FIELDS}
+    with open(path, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        if size < HEADER.size:
+            return 0, columns
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            magic, _, record_size = HEADER.unpack_from(data, 0)
+            if magic != MAGIC or record_size != RECORD.size:
+                raise ValueError(f'{path} is not a session file')
+            total = (size - HEADER.size) // RECORD.size
+            start = max(0, total + start) if start < 0 else min(start, total)
+            end = total if count is None else min(total, start + max(0, count))
+            offset = HEADER.size + start * RECORD.size
+            for record in RECORD.iter_unpack(data[offset:HEADER.size + end * RECORD.size]):
+                for field, value in zip(FIELDS, record):
+                    columns[field].append(None if value != value else value)
+    columns['mode'] = [MODES[value] if value < len(MODES) else None for value in columns['mode']]
+    columns['pump'] = [bool(value) for value in columns['pump']]
+    return total, columns
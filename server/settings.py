@@ -0,0 +1,163 @@
+import json
+import math
+import logging
+from collections import namedtuple
+from hardware import RaspberryPiHardware
+from storage import AtomicWriter
+from zone import Zone
+
+Range = namedtuple('Range', ['minimum', 'maximum'])
+
+# the settings every file has, with the values they may take
+SCHEMA = {
+    'initial_setpoint': Range(0.0, 110.0),
+    'fan_power': Range(0.0, 100.0),
+    'boil_threshold': Range(0.0, 110.0),
+    'boil_power': Range(0.0, 100.0),
+    'k_p': Range(0.0, math.inf),
+    'k_i': Range(0.0, math.inf),
+    'k_d': Range(0.0, math.inf),
+}
+OPTIONAL_SCHEMA = {
+    'control_period': Range(0.001, 60.0),
+}
+ZONE_SCHEMA = {
+    'k_p': Range(0.0, math.inf),
+    'k_i': Range(0.0, math.inf),
+    'k_d': Range(0.0, math.inf),
+    'estimator_lead_time': Range(0.0, 60.0),
+}
+ZONE_FLAGS = ['estimator', 'smith_predictor']
+# a time constant of `None` is a process which integrates
+MODEL_SCHEMA = {
+    'slope': Range(1e-9, math.inf),
+    'time_constant': Range(1e-3, math.inf),
+    'dead_time': Range(0.0, 600.0),
+}
+
+def _validate_number(name, value, valid_range):
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ValueError(f'{name} must be a finite number')
+    if value < valid_range.minimum or value > valid_range.maximum:
+        raise ValueError(f'{name} must be between {valid_range.minimum} and {valid_range.maximum}')
+
+def _validate_zone(zone):
+    if not isinstance(zone, dict):
+        raise ValueError('zones must be objects')
+    name = zone.get('name')
+    if not isinstance(name, str) or Zone.NAME_PATTERN.fullmatch(name) is None:
+        raise ValueError('zone name must only contain letters, digits and underscores')
+    for key, valid_range in ZONE_SCHEMA.items():
+        if key in zone:
+            _validate_number(f'{name}.{key}', zone[key], valid_range)
+    for key in ZONE_FLAGS:
+        if key in zone and not isinstance(zone[key], bool):
+            raise ValueError(f'{name}.{key} must be true or false')
+    if 'model' in zone:
+        model = zone['model']
+        if not isinstance(model, dict):
+            raise ValueError(f'{name}.model must be an object')
+        for key, valid_range in MODEL_SCHEMA.items():
+            if key not in model:
+                raise ValueError(f'{name}.model.{key} is missing')
+            if key == 'time_constant' and model[key] is None:
+                continue
+            _validate_number(f'{name}.model.{key}', model[key], valid_range)
+    if 'sensor' in zone and not isinstance(zone['sensor'], str):
+        raise ValueError(f'{name}.sensor must be a string')
+    if 'heater_pin' in zone and (isinstance(zone['heater_pin'], bool) or not isinstance(zone['heater_pin'], int)):
+        raise ValueError(f'{name}.heater_pin must be an integer')
+    if zone.get('heater_pin') in RaspberryPiHardware.RESERVED_PINS:
+        raise ValueError(f'{name}.heater_pin {zone["heater_pin"]} is already used by the controller')
+
+def validate_settings(settings, partial=False):
+    """Check settings against the schema, raises `ValueError` if they don't match.
+
+    Args:
+        settings (dict): The settings.
+        partial (bool): Whether settings may be missing, to check values before
+            they are applied.
+    """
+    if not isinstance(settings, dict):
+        raise ValueError('settings must be an object')
+    for key, valid_range in SCHEMA.items():
+        if key in settings:
+            _validate_number(key, settings[key], valid_range)
+        elif not partial:
+            raise ValueError(f'{key} is missing')
+    for key, valid_range in OPTIONAL_SCHEMA.items():
+        if key in settings:
+            _validate_number(key, settings[key], valid_range)
+    if 'zones' in settings:
+        zones = settings['zones']
+        if not isinstance(zones, list):
+            raise ValueError('zones must be a list')
+        for zone in zones:
+            _validate_zone(zone)
+        names = [zone['name'] for zone in zones]
+        if len(set(names)) != len(names):
+            raise ValueError('zone names must be unique')
+        # two zones on one heater would both set its duty cycle every tick, the last one winning
+        heater_pins = [zone.get('heater_pin') for zone in zones]
+        if heater_pins.count(None) > 1:
+            raise ValueError('only one zone may use the hardware PWM heater, the others need a heater_pin')
+        if len(set(heater_pins)) != len(heater_pins):
+            raise ValueError('zone heater pins must be unique')
+        sensors = [zone['sensor'] for zone in zones if 'sensor' in zone]
+        if len(set(sensors)) != len(sensors):
+            raise ValueError('zone sensors must be unique')
+
+class SettingsStore(object):
+    """Keeps the settings in a JSON file.
+
+    Saving only validates and hands the settings to a background writer,
+    which waits `delay` seconds for further changes so a burst of edits is
+    written once. The file is replaced atomically and mirrored to a backup,
+    which is loaded if the file is missing a setting or can't be parsed.
+
+    Args:
+        path (str): The settings file.
+        delay (float): How long to wait for further changes before writing, in
+            seconds.
+    """
+    BACKUP_SUFFIX = '.bak'
+
+    def __init__(self, path, delay=1.0):
+        self._logger = logging.getLogger(type(self).__name__)
+        self._writer = AtomicWriter(path, delay, path + SettingsStore.BACKUP_SUFFIX)
+
+    @property
+    def path(self):
+        return self._writer.path
+
+    def load(self):
+        """Read the settings, returns `None` if neither the file nor the backup
+        has valid settings."""
+        for path in [self._writer.path, self._writer.backup_path]:
+            try:
+                with open(path, 'r') as file:
+                    settings = json.load(file)
+                validate_settings(settings)
+            except FileNotFoundError:
+                continue
+            except (OSError, ValueError) as error:
+                # json.JSONDecodeError is a ValueError too
+                self._logger.warning('ignoring %s: %s', path, error)
+                continue
+            if path != self._writer.path:
+                self._logger.warning('loaded the backup %s', path)
+            return settings
+        return None
+
+    def save(self, settings):
+        """Validate settings and write them in the background, raises
+        `ValueError` if they are invalid."""
+        validate_settings(settings)
+        self._writer.submit(json.dumps(settings).encode())
+
+    def start(self):
+        self._writer.start()
+
+    def stop(self):
+        """Write pending settings and stop the writer."""
+        self._writer.stop()
@@ -0,0 +1,129 @@
+import math
+import random
+from collections import deque
+
+class Kettle(object):
+    """First order plus dead time thermal model of an electrically heated kettle.
+
+    Args:
+        volume (float): Liquid volume in liters.
+        heater_power (float): Heater power at 100% duty cycle in watts.
+        loss (float): Heat loss to the surroundings in watts per kelvin.
+        ambient (float): Ambient temperature in °C.
+        dead_time (float): Delay between heater power changes and the liquid
+            starting to respond in seconds.
+        sensor_lag (float): Time constant of the temperature probe in seconds.
+        sensor_noise (float): Standard deviation of the probe noise in °C.
+        temperature (float): Initial temperature in °C, ambient if not specified.
+        boiling_point (float): Temperature which the liquid can't exceed in °C.
+    """
+    SPECIFIC_HEAT = 4186.0
+    SENSOR_RESOLUTION = 0.0625
+
+    def __init__(self, volume=30.0, heater_power=3000.0, loss=15.0, ambient=20.0,
+                 dead_time=20.0, sensor_lag=10.0, sensor_noise=0.02,
+                 temperature=None, boiling_point=100.0, seed=None):
+        if volume <= 0:
+            raise ValueError('volume must be greater than 0')
+        if heater_power < 0:
+            raise ValueError('heater_power must be greater or equal to 0')
+        if dead_time < 0:
+            raise ValueError('dead_time must be greater or equal to 0')
+        if sensor_lag < 0:
+            raise ValueError('sensor_lag must be greater or equal to 0')
+
+        self._heat_capacity = volume * Kettle.SPECIFIC_HEAT
+        self._heater_power = heater_power
+        self._loss = loss
+        self._ambient = ambient
+        self._dead_time = dead_time
+        self._sensor_lag = sensor_lag
+        self._sensor_noise = sensor_noise
+        self._boiling_point = boiling_point
+        self._random = random.Random(seed)
+        self._temperature = ambient if temperature is None else temperature
+        self._sensor_temperature = self._temperature
+        self._duty_cycle = 0.0
+        self._pending = deque()
+        self._delayed_duty_cycle = 0.0
+        self._time = 0.0
+        self._energy = 0.0
+
+    @property
+    def temperature(self):
+        return self._temperature
+
+    @property
+    def time(self):
+        return self._time
+
+    @property
+    def energy(self):
+        """Heater energy used so far in joules."""
+        return self._energy
+
+    @property
+    def duty_cycle(self):
+        return self._duty_cycle
+
+    @duty_cycle.setter
+    def duty_cycle(self, value):
+        self._duty_cycle = min(100.0, max(0.0, value))
+        self._pending.append((self._time + self._dead_time, self._duty_cycle))
+
+    def read_sensor(self, resolution=SENSOR_RESOLUTION):
+        """Get the probe temperature rounded to a DS18B20 resolution in °C."""
+        value = self._sensor_temperature
+        if self._sensor_noise > 0:
+            value += self._random.gauss(0.0, self._sensor_noise)
+        return round(value / resolution) * resolution
+
+    def advance(self, seconds, max_step=0.5):
+        """Advance the model, integrating in steps of at most `max_step` seconds."""
+        while seconds > 0:
+            dt = min(seconds, max_step)
+            self._step(dt)
+            seconds -= dt
+
+    def _step(self, dt):
+        self._time += dt
+        while self._pending and self._pending[0][0] <= self._time:
+            self._delayed_duty_cycle = self._pending.popleft()[1]
+        power = self._heater_power * self._delayed_duty_cycle / 100
+        self._energy += self._heater_power * self._duty_cycle / 100 * dt
+        self._temperature += (power - self._loss * (self._temperature - self._ambient)) / self._heat_capacity * dt
+        # energy above the boiling point goes into evaporation
+        self._temperature = min(self._temperature, self._boiling_point)
+        if self._sensor_lag > 0:
+            self._sensor_temperature += (self._temperature - self._sensor_temperature) * (1 - math.exp(-dt / self._sensor_lag))
+        else:
+            self._sensor_temperature = self._temperature
+
+def simulate(kettle, clock, controller, duration, sampletime=1.0):
+    """Run a controller against a kettle as fast as possible.
+
+    Args:
+        kettle (Kettle): The plant.
+        clock (ManualClock): The clock the controller was created with, it's
+            advanced along with the kettle.
+        controller (function): Called with the measured temperature once per
+            sample, returns the duty cycle or `None` to stop.
+        duration (float): Simulated time in seconds.
+        sampletime (float): The interval between controller calls in seconds.
+
+    Returns:
+        A list of (time, measured temperature, duty cycle) tuples.
+    """
+    trace = []
+    elapsed = 0.0
+    while elapsed < duration:
+        measured = kettle.read_sensor()
+        duty_cycle = controller(measured)
+        if duty_cycle is None:
+            break
+        kettle.duty_cycle = duty_cycle
+        trace.append((elapsed, measured, kettle.duty_cycle))
+        kettle.advance(sampletime)
+        clock.advance(sampletime)
+        elapsed += sampletime
+    return trace
@@ -0,0 +1,48 @@
+import gzip
+import json
+import hashlib
+import threading
+
+class Snapshot(object):
+    """An immutable JSON response body which is encoded at most once.
+
+    The data is captured while the caller holds the control lock, encoding
+    and hashing happen on first use without it. Every request served from
+    the same snapshot gets the same bytes and ETag.
+
+    Args:
+        data: The data to encode, must not be modified afterwards.
+        finish (function): Converts the data into something JSON serializable
+            right before encoding.
+    """
+
+    def __init__(self, data, finish=None):
+        self._data = data
+        self._finish = finish
+        self._body = None
+        self._etag = None
+        self._gzip_body = None
+        self._lock = threading.Lock()
+
+    def encode(self):
+        """Get the encoded body and its ETag."""
+        if self._body is None:
+            with self._lock:
+                if self._body is None:
+                    data = self._data if self._finish is None else self._finish(self._data)
+                    body = json.dumps(data).encode()
+                    self._etag = hashlib.blake2b(body, digest_size=8).hexdigest()
+                    self._body = body
+                    self._data = None
+        return self._body, self._etag
+
+    def encode_gzip(self):
+        """Get the gzip compressed body and its ETag, compressed once for all
+        clients."""
+        body, etag = self.encode()
+        if self._gzip_body is None:
+            with self._lock:
+                if self._gzip_body is None:
+                    self._gzip_body = gzip.compress(body, compresslevel=6, mtime=0)
+        # a strong ETag must differ between encodings of the same body
+        return self._gzip_body, etag + '-gzip'
@@ -0,0 +1,99 @@
+from downsample import MinMaxDownsampler
+from history import History
+from sensor import CONVERSION_TIMES
+
+def get_chart_downsampler(zone, points):
+    chart_history = zone.chart_history
+    chart_downsamplers = zone.chart_downsamplers
+    # two points per bucket over the samples kept, rounded up to a power of two so the history filling up only
+    # switches to a new downsampler when the bucket size doubles
+    bucket_size = max(1, -(-len(chart_history) // max(1, points // 2)))
+    bucket_size = 1 << (bucket_size - 1).bit_length()
+    downsampler = chart_downsamplers.pop(bucket_size, None)
+    if downsampler is None:
+        downsampler = MinMaxDownsampler(chart_history, bucket_size)
+        if len(chart_downsamplers) >= 4:
+            chart_downsamplers.pop(next(iter(chart_downsamplers)))
+    chart_downsamplers[bucket_size] = downsampler
+    return downsampler
+
+def build_status(zone, pump, resolution, since=None, points=None, terms=False, estimate=False):
+    """Build the response of `GET /api/status` for a zone, the caller holds
+    the control lock. The chart columns are still arrays, `finish_status()`
+    makes them JSON serializable.
+
+    Args:
+        zone (Zone): The zone.
+        pump (bool): Whether the pump is on.
+        resolution (int): The resolution the sensor of the zone converted the
+            latest reading at in bits, `None` if the driver can't set it.
+        since (int): The chart cursor of the client's last response, all
+            chart samples if not specified.
+        points (int): Downsample the chart to about this many points.
+        terms (bool): Whether to add the charts of the PID terms.
+        estimate (bool): Whether to add the charts of the estimated and
+            controlled temperature.
+    """
+    chart_history = zone.chart_history
+    response = {}
+    response["zone"] = zone.name
+    response["mode"] = zone.mode
+    response["pump"] = pump
+    response["temperature"] = None if zone.has_temperature_sensor_error else zone.temperature
+    response["temperatureStale"] = zone.is_temperature_stale
+    response["temperatureEstimate"] = zone.estimated_temperature
+    response["temperatureRate"] = zone.estimated_rate
+    response["controlTemperature"] = zone.control_temperature
+    response["setpoint"] = zone.setpoint
+    response["dutyCycle"] = zone.duty_cycle
+    response["sensorResolution"] = resolution
+    response["conversionTime"] = CONVERSION_TIMES.get(resolution)
+    if points is None:
+        # chart samples are numbered by a cursor, a client that passes the cursor of its last response only gets the
+        # samples appended after it, anything it can't continue from (first load, evicted or reset data) gets everything
+        chart_full = not chart_history.is_continuous(since)
+        chart = chart_history.tail(None if chart_full else chart_history.cursor - since)
+        set_chart(response, chart, terms, estimate)
+        response["chartLength"] = len(chart_history)
+    else:
+        # a downsampled chart is already small, so it's always sent whole; only copying the samples happens under
+        # the lock, finish_status() reduces the copy
+        chart_full = True
+        response["_downsample"] = (get_chart_downsampler(zone, points), chart_history.copy(), terms, estimate)
+    response["chartFull"] = chart_full
+    response["chartCursor"] = chart_history.cursor
+    response["boilAchieved"] = zone.boil_achieved
+    if zone.pid is None:
+        response["pidTerms"] = None
+    else:
+        state = zone.pid.state
+        response["pidTerms"] = dict(error=state.error, p=state.p, i=state.i, d=state.d)
+    if not zone.tuner is None:
+        response["autotunePeakCount"] = zone.tuner.peak_count
+    return response
+
+def set_chart(response, chart, terms, estimate):
+    response["chartX"] = chart["timestamp"]
+    response["chartTemperatureY"] = chart["temperature"]
+    response["chartSetpointY"] = chart["setpoint"]
+    response["chartDutyCycleY"] = chart["duty_cycle"]
+    if terms:
+        response["chartPY"] = chart["p"]
+        response["chartIY"] = chart["i"]
+        response["chartDY"] = chart["d"]
+    if estimate:
+        response["chartEstimateY"] = chart["estimate"]
+        response["chartControlY"] = chart["control"]
+
+def finish_status(response):
+    # downsampling and converting chart arrays are the expensive parts, they are done after releasing the lock
+    if "_downsample" in response:
+        downsampler, chart_history, terms, estimate = response.pop("_downsample")
+        chart = downsampler.reduce(chart_history)
+        set_chart(response, chart, terms, estimate)
+        response["chartLength"] = len(chart["timestamp"])
+    for key in ["chartX", "chartTemperatureY", "chartSetpointY", "chartDutyCycleY", "chartPY", "chartIY", "chartDY",
+                "chartEstimateY", "chartControlY"]:
+        if key in response and not isinstance(response[key], list):
+            response[key] = History.to_list(response[key])
+    return response
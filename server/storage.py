@@ -0,0 +1,122 @@
+import os
+import threading
+import logging
+import tempfile
+
+def atomic_write(path, data):
+    """Replace a file with new contents, so that after a crash it holds either
+    the old or the new contents but never a mix.
+
+    The data is written to a temporary file in the same directory, synced and
+    renamed over the target, then the directory is synced so the rename is
+    durable too.
+
+    Args:
+        path (str): The file to replace.
+        data (bytes): The new contents.
+    """
+    directory = os.path.dirname(path) or '.'
+    # mkstemp creates the file private, the replacement keeps the permissions of the file it replaces
+    try:
+        mode = os.stat(path).st_mode & 0o777
+    except FileNotFoundError:
+        mode = 0o644
+    fd, temporary_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            os.fchmod(file.fileno(), mode)
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, path)
+    except BaseException:
+        try:
+            os.unlink(temporary_path)
+        except OSError:
+            pass
+        raise
+    directory_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(directory_fd)
+    finally:
+        os.close(directory_fd)
+
+class AtomicWriter(object):
+    """Writes a file atomically in a background thread.
+
+    Only the latest submitted contents are written, contents replaced before
+    the thread got to them are skipped, so submitting never waits for the SD
+    card and bursts of changes cost a single write.
+
+    Args:
+        path (str): The file to replace.
+        delay (float): How long to wait for further changes after a
+            submission before writing, in seconds.
+        backup_path (str): A file which receives the same contents after
+            `path` was replaced, so one of both is complete even if the
+            storage corrupts a file. `None` to keep no backup.
+    """
+
+    def __init__(self, path, delay=0.0, backup_path=None):
+        if delay < 0:
+            raise ValueError('delay must be greater or equal to 0')
+
+        self._logger = logging.getLogger(type(self).__name__)
+        self._path = path
+        self._delay = delay
+        self._backup_path = backup_path
+        self._pending = None
+        self._condition = threading.Condition()
+        self._stopping = False
+        self._thread = None
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def backup_path(self):
+        return self._backup_path
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name='atomic-writer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Write pending contents and stop the thread."""
+        if self._thread is None:
+            return
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        self._thread.join()
+        self._thread = None
+
+    def submit(self, data):
+        with self._condition:
+            self._pending = data
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._pending is None and not self._stopping:
+                    self._condition.wait()
+                if self._pending is not None and not self._stopping and self._delay > 0:
+                    # later submissions within the delay replace the pending contents
+                    self._condition.wait_for(lambda: self._stopping, self._delay)
+                data = self._pending
+                self._pending = None
+                stopping = self._stopping
+            if data is not None:
+                try:
+                    atomic_write(self._path, data)
+                    if self._backup_path is not None:
+                        atomic_write(self._backup_path, data)
+                except OSError:
+                    self._logger.exception('writing %s failed', self._path)
+            if stopping:
+                return
@@ -0,0 +1,75 @@
+import re
+from history import History
+
+CHART_FIELDS = [("timestamp", "q"), ("temperature", "d"), ("setpoint", "d"), ("duty_cycle", "d"),
+                ("p", "d"), ("i", "d"), ("d", "d"), ("estimate", "d"), ("control", "d")]
+
+class Zone(object):
+    """The state of one vessel, its temperature sensor, heater and controller.
+
+    Args:
+        name (str): Identifies the zone in the API, letters, digits and
+            underscores only.
+        sensor (str): The name of the temperature sensor, `None` if no sensor
+            was found for the zone.
+        heater (function): Sets the duty cycle of the heater.
+        heater_pin (int): The board pin of a software PWM heater, `None` for
+            the hardware PWM heater.
+        history_capacity (int): How many chart samples are kept.
+    """
+    NAME_PATTERN = re.compile(r'\w+')
+
+    def __init__(self, name, sensor, heater, heater_pin=None, history_capacity=3600):
+        if not isinstance(name, str) or Zone.NAME_PATTERN.fullmatch(name) is None:
+            raise ValueError('name must only contain letters, digits and underscores')
+
+        self.name = name
+        self.sensor = sensor
+        # whether the sensor comes from the settings rather than from discovery
+        self.sensor_configured = False
+        self.heater = heater
+        self.heater_pin = heater_pin
+
+        self.mode = "off"
+        self.has_temperature_sensor_error = True
+        self.is_temperature_stale = False
+        self.reading = None
+        self.temperature = 0.0
+        self.estimated_temperature = None
+        self.estimated_rate = None
+        # what the PID controls, the measured or estimated temperature plus the Smith predictor correction
+        self.control_temperature = None
+        self.previous_temperature = 0.0
+        self.setpoint = 0.0
+        self.duty_cycle = 0.0
+        self.previous_duty_cycle = 0.0
+        self.alarm_armed = False
+        self.boil_achieved = False
+        self.sensor_resolution = None
+        # how long the PID output has been at a limit in seconds
+        self.saturated_elapsed = 0.0
+
+        self.k_p = 1.0
+        self.k_i = 1.0
+        self.k_d = 1.0
+        self.pid = None
+        # the timestamp of the reading the PID last calculated with
+        self.pid_input_timestamp = None
+        self.tuner = None
+        self.peak_count = 0
+
+        self.estimator_enabled = False
+        self.estimator_lead_time = 0.0
+        self.smith_predictor_enabled = False
+        # the (slope, time constant, dead time) of the process, identified by the step autotune
+        self.model = None
+        self.estimator = None
+        self.estimator_timestamp = None
+        self.predictor = None
+
+        self.chart_history = History(history_capacity, CHART_FIELDS)
+        self.chart_downsamplers = {}
+        self.status_snapshot = None
+        # recording while the zone is off too, until it's stopped again
+        self.session_requested = False
+        self.session_writer = None
@@ -10,8 +10,12 @@ function getUrlWithParams(endpoint: string, params: QueryParams): string {
 	return BASE_API_URL + endpoint + '?' + new URLSearchParams(stringParams)
 }
 
-export async function getJson<ReturnType>(endpoint: string): Promise<ReturnType> {
-	return await fetch(BASE_API_URL + endpoint).then((response) => {
+export async function getJson<ReturnType>(
+	endpoint: string,
+	params?: QueryParams,
+): Promise<ReturnType> {
+	const url = params == null ? BASE_API_URL + endpoint : getUrlWithParams(endpoint, params)
+	return await fetch(url).then((response) => {
 		return response.json() as ReturnType
 	})
 }
@@ -23,3 +27,25 @@ export async function putWithParams(endpoint: string, params: QueryParams): Prom
 		}
 	})
 }
+
+let eventSource: EventSource | undefined
+
+function getEventSource(): EventSource {
+	if (eventSource == null) {
+		eventSource = new EventSource(BASE_API_URL + '/stream')
+	}
+	return eventSource
+}
+
+export function subscribe<DataType>(event: string, listener: (data: DataType) => void): () => void {
+	const source = getEventSource()
+	const handler = (messageEvent: MessageEvent) => listener(JSON.parse(messageEvent.data) as DataType)
+	source.addEventListener(event, handler)
+	return () => source.removeEventListener(event, handler)
+}
+
+export function onConnect(listener: () => void): () => void {
+	const source = getEventSource()
+	source.addEventListener('open', listener)
+	return () => source.removeEventListener('open', listener)
+}